@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# /local/lib/python3/cmk_addons/plugins/ovirt/agent_based/ovirt_agent_performance.py
+"""Check for the performance of the oVirt special agent"""
+
+# License: GNU General Public License v2
+
+from typing import Any, Dict
+
+from cmk.agent_based.v2 import (
+    AgentSection,
+    CheckPlugin,
+    CheckResult,
+    DiscoveryResult,
+    Metric,
+    Result,
+    Service,
+    State,
+    check_levels,
+    render,
+)
+from cmk_addons.plugins.ovirt.lib import parse_json_section
+
+agent_section_ovirt_agent_performance = AgentSection(
+    name="ovirt_agent_performance",
+    parse_function=parse_json_section,
+)
+
+def discovery_ovirt_agent_performance(section) -> DiscoveryResult:
+    """Discover oVirt special agent performance service"""
+    if "runtime" in section:
+        yield Service()
+
+def check_ovirt_agent_performance(params: Dict[str, Any], section) -> CheckResult:
+    """Check runtime, API requests and processing stages of the oVirt special agent"""
+    yield from check_levels(
+        section.get("runtime", 0.0),
+        levels_upper=params.get("runtime"),
+        metric_name="ovirt_agent_runtime",
+        label="Runtime",
+        render_func=render.timespan,
+    )
+    
+    requests = section.get("requests", [])
+    total_bytes = sum(request.get("bytes", 0) for request in requests)
+    yield Result(state=State.OK, summary=f"{len(requests)} API requests, {render.bytes(total_bytes)}")
+    yield Metric("ovirt_agent_requests", len(requests))
+    yield Metric("ovirt_agent_response_bytes", total_bytes)
+    
+    failed = sorted({request.get("name", "unknown") for request in requests
+                     if not request.get("status") or request["status"] >= 400})
+    if failed:
+        yield Result(state=State.WARN, summary=f"Failed requests: {', '.join(failed)}")
+    
+    # Sum up paged and repeated requests per endpoint
+    endpoints = {}
+    for request in requests:
+        endpoint = endpoints.setdefault(
+            request.get("name", "unknown"), {"requests": 0, "seconds": 0.0, "bytes": 0, "objects": 0})
+        endpoint["requests"] += 1
+        endpoint["seconds"] += request.get("seconds", 0.0)
+        endpoint["bytes"] += request.get("bytes", 0)
+        endpoint["objects"] += request.get("objects") or 0
+    
+    for name, endpoint in sorted(endpoints.items()):
+        yield Result(
+            state=State.OK,
+            notice=(f"Endpoint {name}: {endpoint['requests']} requests, "
+                    f"{render.timespan(endpoint['seconds'])}, {render.bytes(endpoint['bytes'])}, "
+                    f"{endpoint['objects']} objects"),
+        )
+        yield Metric(f"ovirt_agent_{name}_request_time", endpoint["seconds"])
+        yield Metric(f"ovirt_agent_{name}_response_bytes", endpoint["bytes"])
+        yield Metric(f"ovirt_agent_{name}_objects", endpoint["objects"])
+    
+    for stage in section.get("stages", []):
+        name = stage.get("name", "unknown")
+        seconds = stage.get("seconds", 0.0)
+        yield Result(
+            state=State.OK,
+            notice=f"Stage {name}: {render.timespan(seconds)}, {stage.get('objects', 0)} objects",
+        )
+        yield Metric(f"ovirt_agent_{name}_stage_time", seconds)
+    
+    if section.get("cached"):
+        yield Result(state=State.OK, notice=f"Served from cache: {', '.join(section['cached'])}")
+
+check_plugin_ovirt_agent_performance = CheckPlugin(
+    name="ovirt_agent_performance",
+    service_name="oVirt Agent Performance",
+    discovery_function=discovery_ovirt_agent_performance,
+    check_function=check_ovirt_agent_performance,
+    check_default_parameters={
+        "runtime": ("fixed", (45.0, 55.0)),
+    },
+    check_ruleset_name="ovirt_agent_performance",
+)
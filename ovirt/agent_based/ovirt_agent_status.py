@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# /local/lib/python3/cmk_addons/plugins/ovirt/agent_based/ovirt_agent_status.py
+"""Check for the completeness of the oVirt special agent output"""
+
+# License: GNU General Public License v2
+
+import time
+
+from cmk.agent_based.v2 import (
+    AgentSection,
+    CheckPlugin,
+    CheckResult,
+    DiscoveryResult,
+    Result,
+    Service,
+    State,
+    render,
+)
+from cmk_addons.plugins.ovirt.lib import parse_json_section
+
+agent_section_ovirt_agent_status = AgentSection(
+    name="ovirt_agent_status",
+    parse_function=parse_json_section,
+)
+
+def discovery_ovirt_agent_status(section) -> DiscoveryResult:
+    """Discover oVirt special agent status service"""
+    if section:
+        yield Service()
+
+def check_ovirt_agent_status(section) -> CheckResult:
+    """Report API endpoints the special agent could not deliver or served from old data,
+    and the circuit breaker protecting the engine"""
+    now = time.time()
+    
+    skipped = section.get("skipped", [])
+    if skipped:
+        timeout = section.get("timeout")
+        budget = f" ({render.timespan(timeout)})" if timeout else ""
+        yield Result(
+            state=State.WARN,
+            summary=f"Time budget{budget} exhausted, skipped: {', '.join(skipped)}",
+            details="Sections of the skipped endpoints were not updated in this run",
+        )
+    
+    failed = section.get("failed", [])
+    if failed:
+        yield Result(
+            state=State.WARN,
+            summary=f"Endpoints failed without last good data: {', '.join(failed)}",
+            details="Sections of the failed endpoints are missing or incomplete in this run",
+        )
+    
+    stale = section.get("stale", {})
+    if stale:
+        ages = ", ".join(f"{name} ({render.timespan(max(now - timestamp, 0))} old)"
+                         for name, timestamp in sorted(stale.items()))
+        yield Result(
+            state=State.WARN,
+            summary=f"Endpoints failed, serving last good data: {ages}",
+        )
+    
+    breaker = section.get("breaker", {})
+    if breaker.get("state") == "open":
+        retry_in = (breaker.get("opened") or now) + breaker.get("cool_down", 0) - now
+        yield Result(
+            state=State.CRIT,
+            summary=f"Engine unreachable, circuit breaker open after {breaker.get('failures', 0)} "
+                    f"failed runs, next attempt in {render.timespan(max(retry_in, 0))}",
+        )
+    elif breaker.get("failures"):
+        yield Result(state=State.OK, summary=f"Circuit breaker: {breaker['failures']} failed runs")
+    
+    if not skipped and not failed and not stale:
+        yield Result(state=State.OK, summary="All endpoints collected")
+
+check_plugin_ovirt_agent_status = CheckPlugin(
+    name="ovirt_agent_status",
+    service_name="oVirt Agent Status",
+    discovery_function=discovery_ovirt_agent_status,
+    check_function=check_ovirt_agent_status,
+)
@@ -33,6 +33,10 @@ def check_ovirt_vmstats(section) -> CheckResult:
     
     yield Result(state=State.OK, summary=f"VM: {vm_name}, Type: {vm_type}")
     
+    # Statistics are only collected for running VMs if configured
+    if "status" in section:
+        yield Result(state=State.OK, summary=f"Status: {section['status']}, no statistics collected")
+    
     stats = section.get("statistics", [])
     
     for stat in stats:
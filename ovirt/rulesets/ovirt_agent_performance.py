@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# /local/lib/python3/cmk_addons/plugins/ovirt/rulesets/ovirt_agent_performance.py
+"""Ruleset for the oVirt special agent performance check"""
+
+# License: GNU General Public License v2
+
+from cmk.rulesets.v1 import Title
+from cmk.rulesets.v1.form_specs import (
+    DefaultValue,
+    DictElement,
+    Dictionary,
+    LevelDirection,
+    SimpleLevels,
+    TimeMagnitude,
+    TimeSpan,
+)
+from cmk.rulesets.v1.rule_specs import CheckParameters, HostCondition, Topic
+
+def _valuespec_ovirt_agent_performance():
+    return Dictionary(
+        elements={
+            "runtime": DictElement(
+                parameter_form=SimpleLevels(
+                    title=Title("Upper levels for the runtime of the special agent"),
+                    help_text="Alert before the special agent takes longer than the check interval of the oVirt Engine host.",
+                    form_spec_template=TimeSpan(
+                        displayed_magnitudes=[TimeMagnitude.MINUTE, TimeMagnitude.SECOND],
+                    ),
+                    level_direction=LevelDirection.UPPER,
+                    prefill_fixed_levels=DefaultValue((45.0, 55.0)),
+                ),
+                required=False,
+            ),
+        },
+    )
+
+rule_spec_ovirt_agent_performance = CheckParameters(
+    name="ovirt_agent_performance",
+    title=Title("oVirt special agent performance"),
+    topic=Topic.VIRTUALIZATION,
+    parameter_form=_valuespec_ovirt_agent_performance,
+    condition=HostCondition(),
+)
@@ -7,15 +7,30 @@
 from cmk.rulesets.v1 import Title, Label
 from cmk.rulesets.v1.form_specs import (
     BooleanChoice,
+    DefaultValue,
     DictElement,
     Dictionary,
+    Integer,
+    List,
     String,
     Password,
+    TimeMagnitude,
+    TimeSpan,
     validators,
     migrate_to_password,
 )
 from cmk.rulesets.v1.rule_specs import Topic, SpecialAgent
 
+def _cache_ttl_element(title, default_value):
+    return DictElement(
+        parameter_form=TimeSpan(
+            title=title,
+            displayed_magnitudes=[TimeMagnitude.HOUR, TimeMagnitude.MINUTE, TimeMagnitude.SECOND],
+            prefill=DefaultValue(default_value),
+        ),
+        required=False,
+    )
+
 def _valuespec_special_agents_ovirt():
     return Dictionary(
         elements={
@@ -54,6 +69,60 @@ def _valuespec_special_agents_ovirt():
                 ),
                 required=False,
             ),
+            "additional_engines": DictElement(
+                parameter_form=List(
+                    title=Title("Additional oVirt Engines"),
+                    help_text="Further engines collected by the same special agent process, which saves starting a process per engine. The data of every engine is delivered as piggyback data to the Checkmk host of the engine. All other settings of this rule apply to these engines as well.",
+                    element_template=Dictionary(
+                        elements={
+                            "host_name": DictElement(
+                                parameter_form=String(
+                                    title=Title("Checkmk host of the engine"),
+                                    custom_validate=(validators.LengthInRange(min_value=1),),
+                                ),
+                                required=True,
+                            ),
+                            "engine_url": DictElement(
+                                parameter_form=String(
+                                    title=Title("oVirt Engine URL"),
+                                    custom_validate=(validators.LengthInRange(min_value=1),),
+                                ),
+                                required=True,
+                            ),
+                            "username": DictElement(
+                                parameter_form=String(
+                                    title=Title("Username"),
+                                    prefill=DefaultValue("admin@internal"),
+                                ),
+                                required=True,
+                            ),
+                            "password": DictElement(
+                                parameter_form=Password(
+                                    title=Title("Password"),
+                                    custom_validate=(validators.LengthInRange(min_value=1),),
+                                    migrate=migrate_to_password,
+                                ),
+                                required=True,
+                            ),
+                            "certfile": DictElement(
+                                parameter_form=String(
+                                    title=Title("Certificate file path"),
+                                ),
+                                required=False,
+                            ),
+                        },
+                    ),
+                ),
+                required=False,
+            ),
+            "vm_search": DictElement(
+                parameter_form=String(
+                    title=Title("Filter VMs with a search expression"),
+                    help_text="oVirt search expression the engine filters the VMs with before sending them, e.g. status=up, cluster=production or tag=monitored. Only the matching VMs get piggyback data and snapshot monitoring.",
+                    custom_validate=(validators.LengthInRange(min_value=1),),
+                ),
+                required=False,
+            ),
             "no_piggyback": DictElement(
                 parameter_form=BooleanChoice(
                     label=Label("Disable piggyback data generation"),
@@ -61,6 +130,150 @@ def _valuespec_special_agents_ovirt():
                 ),
                 required=False,
             ),
+            "basic_auth": DictElement(
+                parameter_form=BooleanChoice(
+                    label=Label("Use HTTP basic authentication instead of an SSO token"),
+                    help_text="By default the special agent logs in through the engine SSO service once and reuses the token across runs. If enabled, the credentials are sent with every request instead.",
+                ),
+                required=False,
+            ),
+            "collector": DictElement(
+                parameter_form=Dictionary(
+                    title=Title("Read the output of a collector process"),
+                    help_text="Instead of contacting the oVirt Engine, the special agent prints the output published by a long-running collector process, which keeps its connections and caches warm between runs. The collector has to be started separately with the same connection settings and the additional option --collector, e.g. by a systemd unit of the site user. The special agent fails if the published output is older than three collection intervals.",
+                    elements={
+                        "interval": DictElement(
+                            parameter_form=TimeSpan(
+                                title=Title("Collection interval of the collector"),
+                                displayed_magnitudes=[TimeMagnitude.MINUTE, TimeMagnitude.SECOND],
+                                prefill=DefaultValue(60.0),
+                                custom_validate=(validators.NumberInRange(min_value=1.0),),
+                            ),
+                            required=False,
+                        ),
+                    },
+                ),
+                required=False,
+            ),
+            "max_workers": DictElement(
+                parameter_form=Integer(
+                    title=Title("Maximum concurrent API requests"),
+                    help_text="Number of API requests the special agent sends to the oVirt Engine in parallel",
+                    prefill=DefaultValue(4),
+                    custom_validate=(validators.NumberInRange(min_value=1, max_value=16),),
+                ),
+                required=False,
+            ),
+            "timeout": DictElement(
+                parameter_form=TimeSpan(
+                    title=Title("Time budget of the special agent"),
+                    help_text="Total time the special agent may spend per run. Every API request gets the remaining time as timeout. When the budget is exhausted, the sections completed so far are still delivered and the skipped API endpoints are reported by the service oVirt Agent Status. Keep it below the check interval.",
+                    displayed_magnitudes=[TimeMagnitude.MINUTE, TimeMagnitude.SECOND],
+                    prefill=DefaultValue(50.0),
+                    custom_validate=(validators.NumberInRange(min_value=1.0),),
+                ),
+                required=False,
+            ),
+            "max_stale": DictElement(
+                parameter_form=TimeSpan(
+                    title=Title("Serve last good data when an endpoint fails"),
+                    help_text="The special agent keeps the last good response of every API endpoint. When fetching an endpoint fails, this data is delivered instead as long as it is not older than the configured time, so services do not vanish on short engine outages. Stale data is reported by the service oVirt Agent Status. 0 seconds disables the fallback.",
+                    displayed_magnitudes=[TimeMagnitude.HOUR, TimeMagnitude.MINUTE, TimeMagnitude.SECOND],
+                    prefill=DefaultValue(900.0),
+                ),
+                required=False,
+            ),
+            "retries": DictElement(
+                parameter_form=Integer(
+                    title=Title("Retries of failed API requests"),
+                    help_text="Failed GET requests are retried with exponential backoff within the time budget of the special agent",
+                    prefill=DefaultValue(2),
+                    custom_validate=(validators.NumberInRange(min_value=0, max_value=10),),
+                ),
+                required=False,
+            ),
+            "circuit_breaker": DictElement(
+                parameter_form=Dictionary(
+                    title=Title("Circuit breaker"),
+                    help_text="After a number of consecutive runs with failed requests the special agent stops contacting the oVirt Engine for a cool-down time, also in the following runs, instead of waiting for timeouts every check interval. The last good data is delivered meanwhile.",
+                    elements={
+                        "threshold": DictElement(
+                            parameter_form=Integer(
+                                title=Title("Failed runs until the breaker opens"),
+                                help_text="0 disables the circuit breaker",
+                                prefill=DefaultValue(3),
+                                custom_validate=(validators.NumberInRange(min_value=0),),
+                            ),
+                            required=False,
+                        ),
+                        "cool_down": DictElement(
+                            parameter_form=TimeSpan(
+                                title=Title("Cool-down time"),
+                                displayed_magnitudes=[TimeMagnitude.MINUTE, TimeMagnitude.SECOND],
+                                prefill=DefaultValue(300.0),
+                            ),
+                            required=False,
+                        ),
+                    },
+                ),
+                required=False,
+            ),
+            "page_size": DictElement(
+                parameter_form=Integer(
+                    title=Title("Fetch VMs in pages"),
+                    help_text="Number of VMs requested per API call. The special agent processes one page at a time, so its memory usage does not grow with the number of VMs. 0 fetches all VMs with a single request.",
+                    prefill=DefaultValue(500),
+                    custom_validate=(validators.NumberInRange(min_value=0),),
+                ),
+                required=False,
+            ),
+            "vm_statistics": DictElement(
+                parameter_form=List(
+                    title=Title("VM statistics"),
+                    help_text="Names of the VM statistics of the oVirt API monitored by the VM statistics service, e.g. memory.used, memory.free, cpu.current.total or network.current.total. Other statistics are dropped right after they are received. By default network.current.total, cpu.current.total, cpu.current.hypervisor, cpu.current.guest and memory.installed are monitored.",
+                    element_template=String(
+                        title=Title("Statistic"),
+                        custom_validate=(validators.LengthInRange(min_value=1),),
+                    ),
+                    custom_validate=(validators.LengthInRange(min_value=1),),
+                ),
+                required=False,
+            ),
+            "running_statistics_only": DictElement(
+                parameter_form=BooleanChoice(
+                    label=Label("Collect statistics only for running VMs"),
+                    help_text="If enabled, the engine does not compute and send statistics of VMs that are down, suspended or image locked. These VMs are listed by separate requests without statistics, their VM statistics service shows the VM status instead.",
+                ),
+                required=False,
+            ),
+            "partition_by_cluster": DictElement(
+                parameter_form=BooleanChoice(
+                    label=Label("Fetch the VMs per cluster in parallel"),
+                    help_text="If enabled, the VMs of every cluster are requested separately, as many clusters in parallel as concurrent API requests are allowed. Several small searches are faster for the engine than one large response on engines with many VMs. The list of clusters is fetched in every run then, so VMs of new or renamed clusters are not missed.",
+                ),
+                required=False,
+            ),
+            "events": DictElement(
+                parameter_form=BooleanChoice(
+                    label=Label("Refresh cached data on engine events"),
+                    help_text="If enabled, the special agent fetches the engine events since its last run and fetches the cached data of the endpoints they changed, e.g. after a snapshot was created or a host changed its state, before the cache time expires. Longer cache times can be used then. The snapshots are kept per VM and only fetched again for VMs named in snapshot events and for new VMs, unless the cache time of snapshots is 0.",
+                ),
+                required=False,
+            ),
+            "cache_ttl": DictElement(
+                parameter_form=Dictionary(
+                    title=Title("Cache slow-changing API data"),
+                    help_text="Data of these endpoints is kept on the monitoring server and only fetched again from the oVirt Engine when it is older than the configured time. 0 seconds disables the cache for an endpoint.",
+                    elements={
+                        "api": _cache_ttl_element(Title("Engine product information and summary"), 300.0),
+                        "hosts": _cache_ttl_element(Title("Hosts"), 0.0),
+                        "datacenters": _cache_ttl_element(Title("Datacenters and storage domains"), 300.0),
+                        "clusters": _cache_ttl_element(Title("Clusters"), 900.0),
+                        "snapshots": _cache_ttl_element(Title("VM snapshots"), 900.0),
+                    },
+                ),
+                required=False,
+            ),
         },
     )
 
@@ -14,6 +14,15 @@ from cmk.server_side_calls.v1 import (
     SpecialAgentConfig,
 )
 
+class AdditionalEngine(BaseModel):
+    """An engine collected by the same special agent process"""
+    
+    host_name: str
+    engine_url: str
+    username: str = "admin@internal"
+    password: Secret
+    certfile: str = ""
+
 class Params(BaseModel):
     """Parameters for the oVirt special agent"""
     
@@ -22,7 +31,22 @@ class Params(BaseModel):
     username: str = "admin@internal"
     password: Secret
     certfile: str = ""
+    additional_engines: list[AdditionalEngine] = []
+    vm_search: str = ""
     no_piggyback: bool = False
+    basic_auth: bool = False
+    max_workers: int | None = None
+    timeout: float | None = None
+    page_size: int | None = None
+    partition_by_cluster: bool = False
+    running_statistics_only: bool = False
+    vm_statistics: list[str] = []
+    events: bool = False
+    cache_ttl: dict[str, float] = {}
+    max_stale: float | None = None
+    retries: int | None = None
+    circuit_breaker: dict[str, float] = {}
+    collector: dict[str, float] | None = None
 
 def _agent_ovirt_arguments(
     params: Params, host_config: HostConfig
@@ -44,9 +68,62 @@ def _agent_ovirt_arguments(
     if params.certfile:
         command_arguments += ["--certfile", params.certfile]
     
+    for engine in params.additional_engines:
+        command_arguments += ["--engine", engine.host_name, engine.engine_url, engine.username,
+                              engine.password]
+        if engine.certfile:
+            command_arguments += [engine.certfile]
+    
+    if params.vm_search:
+        command_arguments += ["--vm-search", params.vm_search]
+    
     if params.no_piggyback:
         command_arguments += ["--no-piggyback"]
     
+    if params.basic_auth:
+        command_arguments += ["--basic-auth"]
+    
+    if params.max_workers:
+        command_arguments += ["--max-workers", str(params.max_workers)]
+    
+    if params.timeout:
+        command_arguments += ["--timeout", str(params.timeout)]
+    
+    if params.page_size:
+        command_arguments += ["--page-size", str(params.page_size)]
+    
+    if params.partition_by_cluster:
+        command_arguments += ["--partition-by-cluster"]
+    
+    if params.running_statistics_only:
+        command_arguments += ["--running-statistics-only"]
+    
+    if params.vm_statistics:
+        command_arguments += ["--vm-statistics", ",".join(params.vm_statistics)]
+    
+    if params.events:
+        command_arguments += ["--events"]
+    
+    for endpoint, ttl in sorted(params.cache_ttl.items()):
+        command_arguments += ["--cache-ttl", f"{endpoint}={int(ttl)}"]
+    
+    if params.max_stale is not None:
+        command_arguments += ["--max-stale", str(int(params.max_stale))]
+    
+    if params.retries is not None:
+        command_arguments += ["--retries", str(params.retries)]
+    
+    if "threshold" in params.circuit_breaker:
+        command_arguments += ["--breaker-threshold", str(int(params.circuit_breaker["threshold"]))]
+    
+    if "cool_down" in params.circuit_breaker:
+        command_arguments += ["--breaker-cool-down", str(int(params.circuit_breaker["cool_down"]))]
+    
+    if params.collector is not None:
+        command_arguments += ["--from-collector"]
+        if "interval" in params.collector:
+            command_arguments += ["--interval", str(int(params.collector["interval"]))]
+    
     yield SpecialAgentCommand(command_arguments=command_arguments)
 
 special_agent_ovirt = SpecialAgentConfig(
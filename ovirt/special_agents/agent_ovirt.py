@@ -5,18 +5,32 @@
 # License: GNU General Public License v2
 
 import argparse
+import codecs
+import contextlib
+import hashlib
+import http.client
 import json
 import logging
 import os
+import random
+import re
+import socket
 import sys
 import time
 import functools
+import itertools
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from pathlib import Path
+from urllib.parse import quote
 
 import requests
 import urllib3
-from cmk.special_agents.v0_unstable.agent_common import SectionWriter
+from requests.adapters import BaseAdapter, HTTPAdapter
 from cmk.utils import password_store
+from cmk.utils.paths import tmp_dir
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -24,15 +38,97 @@ password_store.replace_passwords()
 
 LOGGER = logging.getLogger(__name__)
 
-# API endpoints to fetch
-API_ENDPOINTS = [
-    "/api",
-    "/api/hosts?all_content=true",
-    "/api/datacenters?follow=storage_domains",
-    "/api/clusters",
-    "/api/vms?follow=statistics",
-    "/api/vms?follow=snapshots"
-]
+HOSTS_ENDPOINT = "/api/hosts?all_content=true"
+DATACENTERS_ENDPOINT = "/api/datacenters?follow=storage_domains"
+
+# VM collection including everything needed for the VM piggyback sections
+VMS_ENDPOINT = "/api/vms?follow=statistics,snapshots"
+# VM collection used while the snapshots are served from the cache
+VMS_STATS_ENDPOINT = "/api/vms?follow=statistics"
+# VM collections without statistics, used for VMs that are not running
+VMS_SNAPSHOTS_ENDPOINT = "/api/vms?follow=snapshots"
+VMS_LIST_ENDPOINT = "/api/vms"
+
+# API endpoints to fetch besides the VMs, by name
+API_ENDPOINTS = {
+    "api": "/api",
+    "hosts": HOSTS_ENDPOINT,
+    "datacenters": DATACENTERS_ENDPOINT,
+    "clusters": "/api/clusters",
+}
+
+# Seconds the data of an endpoint is served from the cache before it is fetched again
+DEFAULT_CACHE_TTLS = {
+    "api": 300,
+    "hosts": 0,
+    "datacenters": 300,
+    "clusters": 900,
+    "snapshots": 900,
+}
+
+EVENTS_ENDPOINT = "/api/events"
+
+# Maximum number of events fetched per run, with more events all cached data is refreshed
+EVENTS_MAX = 1000
+
+# Codes of the engine events about created and removed snapshots
+SNAPSHOT_EVENT_CODES = frozenset({
+    45,   # USER_CREATE_SNAPSHOT
+    68,   # USER_CREATE_SNAPSHOT_FINISHED_SUCCESS
+    69,   # USER_CREATE_SNAPSHOT_FINISHED_FAILURE
+    342,  # USER_REMOVE_SNAPSHOT
+    356,  # USER_REMOVE_SNAPSHOT_FINISHED_SUCCESS
+    357,  # USER_REMOVE_SNAPSHOT_FINISHED_FAILURE
+})
+
+# Codes of the engine events about added and removed VMs
+VM_INVENTORY_EVENT_CODES = frozenset({
+    34,   # USER_ADD_VM
+    53,   # USER_ADD_VM_FINISHED_SUCCESS
+    113,  # USER_REMOVE_VM_FINISHED
+})
+
+# VM statistics written to the piggyback data by default
+DEFAULT_VM_STATISTICS = frozenset({
+    "network.current.total",
+    "cpu.current.total",
+    "cpu.current.hypervisor",
+    "cpu.current.guest",
+    "memory.installed",
+})
+
+# States of VMs that are not running and have no statistics, see --running-statistics-only
+STOPPED_VM_STATES = ("down", "suspended", "image_locked")
+
+# Attributes kept from the API objects
+HOST_KEYS = ["version", "status", "summary", "type", "name", "libvirt_version", "hosted_engine"]
+DATACENTER_KEYS = ["id", "version", "status", "description", "name", "supported_versions"]
+STORAGE_DOMAIN_KEYS = ["status", "name", "id", "external_status", "description",
+                       "committed", "available", "used", "warning_low_space_indicator"]
+SNAPSHOT_KEYS = ["snapshot_status", "snapshot_type", "description", "date", "id"]
+
+# Default number of API requests issued in parallel
+DEFAULT_MAX_WORKERS = 4
+
+# Default maximum age in seconds of the last good data served when an endpoint fails
+DEFAULT_MAX_STALE = 900
+
+# Default number of retries of a failed GET request
+DEFAULT_RETRIES = 2
+
+# Default number of consecutive runs with failed requests after which the circuit breaker
+# stops sending requests to the engine, and the time in seconds until it tries again
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_COOL_DOWN = 300
+
+# Default collection interval of the collector process in seconds
+DEFAULT_COLLECTOR_INTERVAL = 60
+
+# Default time budget of a run in seconds, below the usual check interval of one minute
+DEFAULT_TIMEOUT = 50
+
+# Directory for state kept between runs, e.g. cached SSO tokens
+DEFAULT_CACHE_DIR = Path(tmp_dir) / "agents" / "agent_ovirt"
 
 def parse_arguments(argv):
     """Parse command line arguments"""
@@ -53,11 +149,133 @@ def parse_arguments(argv):
     group.add_argument("-s", "--secret", help="oVirt Engine password manually entered")
     
     parser.add_argument("--certfile", help="Path to certificate file")
+    parser.add_argument("--engine", action="append", nargs="+", default=[],
+                        metavar=("HOST", "URL USERNAME PASSWORD [CERTFILE]"),
+                        help="Collect an additional engine in the same run. Its sections are written as "
+                             "piggyback data of HOST. PASSWORD is a reference to the CMK password store. "
+                             "Can be given multiple times")
     parser.add_argument("--no-piggyback", action="store_true", 
                         help="Disable generation of piggyback data")
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Maximum number of concurrent API requests (default: %(default)s)")
+    parser.add_argument("--vm-search", default="", metavar="EXPRESSION",
+                        help="oVirt search expression the engine filters the VMs with, e.g. "
+                             "\"status=up\", \"cluster=production\" or \"tag=monitored\"")
+    parser.add_argument("--partition-by-cluster", action="store_true",
+                        help="Fetch the VMs of every cluster with a separate request, up to --max-workers "
+                             "in parallel, instead of all VMs at once. The clusters are not cached then")
+    parser.add_argument("--running-statistics-only", action="store_true",
+                        help="Do not fetch statistics of VMs that are down, suspended or image locked, these "
+                             "VMs are listed with their status by separate requests without statistics")
+    parser.add_argument("--vm-statistics", type=lambda value: frozenset(filter(None, value.split(","))),
+                        default=DEFAULT_VM_STATISTICS, metavar="NAME,...",
+                        help="Comma separated names of the VM statistics to monitor, e.g. "
+                             "\"memory.used,cpu.current.total\" (default: %s)"
+                             % ",".join(sorted(DEFAULT_VM_STATISTICS)))
+    parser.add_argument("--events", action="store_true",
+                        help="Fetch the engine events since the last run and refresh the cached data "
+                             "of the endpoints they changed before its TTL expires")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="Time budget of the whole run in seconds. Requests get the remaining time as "
+                             "timeout, sections completed within the budget are still written "
+                             "(default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="Retry failed GET requests up to this many times with exponential backoff "
+                             "(default: %(default)s)")
+    parser.add_argument("--breaker-threshold", type=int, default=DEFAULT_BREAKER_THRESHOLD,
+                        metavar="FAILURES",
+                        help="Stop sending requests to the engine after this many consecutive runs with "
+                             "failed requests, also in the following runs. 0 disables the circuit breaker "
+                             "(default: %(default)s)")
+    parser.add_argument("--breaker-cool-down", type=int, default=DEFAULT_BREAKER_COOL_DOWN,
+                        metavar="SECONDS",
+                        help="Time after which an open circuit breaker lets requests pass again "
+                             "(default: %(default)s)")
+    parser.add_argument("--page-size", type=int, default=0,
+                        help="Fetch VMs in pages of this many objects instead of one response, 0 disables paging")
+    parser.add_argument("--basic-auth", action="store_true",
+                        help="Send HTTP basic credentials with every request instead of using an SSO token")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR,
+                        help="Directory for data kept between runs (default: %(default)s)")
+    parser.add_argument("--cache-ttl", action="append", default=[], metavar="ENDPOINT=SECONDS",
+                        help="Serve the data of an endpoint from the cache for this many seconds, "
+                             "0 disables caching. Endpoints: %s" % ", ".join(
+                                 f"{name} (default: {ttl})" for name, ttl in DEFAULT_CACHE_TTLS.items()))
+    parser.add_argument("--max-stale", type=int, default=DEFAULT_MAX_STALE, metavar="SECONDS",
+                        help="Keep the last good response of every endpoint and serve it when fetching "
+                             "the endpoint fails, as long as it is not older than this. 0 disables the "
+                             "fallback (default: %(default)s)")
+
+    capture = parser.add_mutually_exclusive_group()
+    capture.add_argument("--record", type=Path, metavar="DIR",
+                         help="Save every raw API response in DIR, additional engines in DIR/HOST. "
+                              "Disables the caches, so every endpoint is fetched")
+    capture.add_argument("--replay", type=Path, metavar="DIR",
+                         help="Serve the API responses saved with --record instead of contacting the "
+                              "engine. Disables the caches, the stale data fallback and the circuit "
+                              "breaker, so every response is processed")
+    parser.add_argument("--collector", action="store_true",
+                        help="Run as collector process: collect the engines every --interval seconds, "
+                             "keeping connections and SSO tokens, and publish the agent output to "
+                             "--output-file")
+    parser.add_argument("--from-collector", action="store_true",
+                        help="Print the agent output published by the collector instead of contacting "
+                             "the engine. Fails if the output is older than three intervals")
+    parser.add_argument("--interval", type=int, default=DEFAULT_COLLECTOR_INTERVAL, metavar="SECONDS",
+                        help="Collection interval of the collector (default: %(default)s)")
+    parser.add_argument("--output-file", type=Path,
+                        help="File the collector publishes the agent output to (default: a file per "
+                             "engine URL in the cache directory)")
 
     args = parser.parse_args(argv)
     
+    for engine in args.engine:
+        if len(engine) not in (4, 5):
+            parser.error("--engine takes HOST URL USERNAME PASSWORD and optionally CERTFILE")
+    if args.collector and args.from_collector:
+        parser.error("--collector and --from-collector are mutually exclusive")
+    if args.interval < 1:
+        parser.error("--interval must be at least 1")
+    if args.output_file is None:
+        # Rules with another VM search or other statistics write other output
+        key = hashlib.sha256(args.engine_url.encode("utf-8")).hexdigest()
+        scope = scope_key(args.vm_search, statistics_option(args.vm_statistics))
+        args.output_file = args.cache_dir / f"{_scoped(f'output_{key}', scope)}.txt"
+    if args.max_workers < 1:
+        parser.error("--max-workers must be at least 1")
+    if args.page_size < 0:
+        parser.error("--page-size must not be negative")
+    if not args.vm_statistics:
+        parser.error("--vm-statistics must name at least one statistic")
+    if args.timeout <= 0:
+        parser.error("--timeout must be positive")
+    if args.max_stale < 0:
+        parser.error("--max-stale must not be negative")
+    if args.retries < 0:
+        parser.error("--retries must not be negative")
+    if args.breaker_threshold < 0:
+        parser.error("--breaker-threshold must not be negative")
+    if args.breaker_cool_down < 0:
+        parser.error("--breaker-cool-down must not be negative")
+    
+    cache_ttls = dict(DEFAULT_CACHE_TTLS)
+    for setting in args.cache_ttl:
+        name, _, seconds = setting.partition("=")
+        if name not in cache_ttls or not seconds.isdigit():
+            parser.error(f"invalid --cache-ttl {setting!r}")
+        cache_ttls[name] = int(seconds)
+    args.cache_ttl = cache_ttls
+    
+    # A recording has to contain every endpoint, so nothing is served from the cache
+    if args.record is not None or args.replay is not None:
+        args.cache_ttl = dict.fromkeys(cache_ttls, 0)
+    
+    # A replay is the only data source, data kept from other runs must not mix in
+    if args.replay is not None:
+        args.max_stale = 0
+        args.breaker_threshold = 0
+        args.basic_auth = True
+    
     # Configure logging based on verbosity
     fmt = "%%(levelname)5s: %s%%(message)s"
     if args.verbose == 0:
@@ -72,6 +290,114 @@ def parse_arguments(argv):
     
     return args
 
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Characters that can follow a complete JSON value
+_DELIMITERS = frozenset(",:]} \t\n\r")
+
+class _JsonStream:
+    """Text buffer over a stream of UTF-8 encoded chunks for incremental JSON decoding"""
+    
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+    
+    def _read(self):
+        """Append the next chunk to the buffer, return False at the end of the stream"""
+        if self._eof:
+            return False
+        
+        # Drop everything that is already decoded
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+        
+        self._utf8.decode(b"", final=True)
+        self._eof = True
+        return False
+    
+    def peek(self):
+        """Skip whitespace and return the next character, or "" at the end of the stream"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                return ""
+    
+    def expect(self, char):
+        """Consume the next character, which has to be char"""
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON stream")
+        self._pos += 1
+    
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number continues in the next chunk unless a delimiter follows,
+                # e.g. "25506." is only the start of a fraction
+                is_number = isinstance(obj, (int, float)) and not isinstance(obj, bool)
+                if self._eof or not is_number or (end < len(self._buffer) and self._buffer[end] in _DELIMITERS):
+                    self._pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            
+            # Read at least as much again as is pending to keep decoding attempts linear
+            pending = len(self._buffer) - self._pos
+            while len(self._buffer) - self._pos < 2 * pending:
+                if not self._read():
+                    break
+
+def iter_json_array(chunks, key):
+    """Yield the elements of the array stored under key in a streamed JSON object
+    
+    Only the current element is materialised, so large collections can be
+    processed while they are still being received.
+    """
+    stream = _JsonStream(chunks)
+    if stream.peek() == "":
+        return
+    
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    
+    while True:
+        name = stream.value()
+        stream.expect(":")
+        if name == key and stream.peek() == "[":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.peek() != ",":
+                        break
+                    stream.expect(",")
+                stream.expect("]")
+        else:
+            stream.value()
+        
+        if stream.peek() != ",":
+            break
+        stream.expect(",")
+    stream.expect("}")
+
 def time_it(func):
     """Decorator to time the function"""
     @functools.wraps(func)
@@ -83,33 +409,1417 @@ def time_it(func):
             LOGGER.info("%r took %ss", func.__name__, time.time() - before)
     return wrapped
 
+def scope_key(*options):
+    """Return the key of state kept on disk that depends on the options of a rule,
+    e.g. the VM search, empty for the default options"""
+    if not any(options):
+        return ""
+    return hashlib.sha256("\0".join(options).encode("utf-8")).hexdigest()[:16]
+
+def _scoped(name, scope):
+    return f"{name}_{scope}" if scope else name
+
+def statistics_option(statistics):
+    """Return the VM statistics as option for scope_key, empty for the default statistics"""
+    return "" if statistics == DEFAULT_VM_STATISTICS else ",".join(sorted(statistics))
+
+def endpoint_name(url):
+    """Return a short name for an API URL, e.g. "vms" for /api/vms?follow=statistics"""
+    path = url.split("?", 1)[0].strip("/").split("/")
+    if path[0] == "sso":
+        return "sso"
+    return path[1] if len(path) > 1 else "api"
+
+def _count_objects(data):
+    """Return the number of objects in a response, the length of a collection or 1"""
+    if not data:
+        return 0
+    if isinstance(data, dict) and len(data) == 1:
+        value = next(iter(data.values()))
+        if isinstance(value, list):
+            return len(value)
+    return 1
+
+class EndpointError(Exception):
+    """An endpoint could not be fetched completely"""
+    
+    def __init__(self, url, error):
+        super().__init__(f"Error fetching {url}: {error}")
+        self.url = url
+
+class DeadlineExceeded(Exception):
+    """The time budget of the run was exhausted before an endpoint was complete"""
+    
+    def __init__(self, url):
+        super().__init__(f"Time budget exhausted before {url} was complete")
+        self.url = url
+
+class Deadline:
+    """Time budget of a run"""
+    
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._end = time.time() + seconds
+    
+    def remaining(self):
+        return self._end - time.time()
+    
+    def expired(self):
+        return self.remaining() <= 0
+    
+    def timeout(self, url):
+        """Return the remaining time as request timeout, raise DeadlineExceeded if there is none left"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(url)
+        return remaining
+    
+    def result(self, future, url):
+        """Wait for the result of a future, raise DeadlineExceeded if it is not done in time"""
+        try:
+            return future.result(timeout=max(self.remaining(), 0))
+        except FuturesTimeoutError:
+            raise DeadlineExceeded(url) from None
+
+class AgentStatus:
+    """Completeness of a run, written as the ovirt_agent_status section"""
+    
+    def __init__(self, deadline=None):
+        self._deadline = deadline
+        self._lock = threading.Lock()
+        self.skipped = []
+        # Endpoints that failed without last good data, their sections are incomplete
+        self.failed = []
+        # Endpoints served from their last good data, with its creation time
+        self.stale = {}
+    
+    def skip(self, url):
+        """Record an endpoint that was skipped or is incomplete because the time budget is exhausted"""
+        name = endpoint_name(url)
+        with self._lock:
+            if name not in self.skipped:
+                self.skipped.append(name)
+    
+    def fail(self, url):
+        """Record an endpoint that failed, also partway through, and has no last good data"""
+        name = endpoint_name(url)
+        with self._lock:
+            if name not in self.failed:
+                self.failed.append(name)
+    
+    def complete(self, name):
+        """Return whether all data of an endpoint was received in this run, fresh or stale"""
+        with self._lock:
+            return name not in self.skipped and name not in self.failed
+    
+    def mark_stale(self, name, timestamp):
+        """Record an endpoint that failed and was served from its last good data"""
+        with self._lock:
+            self.stale[name] = timestamp
+    
+    def result(self, future, url):
+        """Wait for the result of the fetch of an endpoint within the time budget"""
+        if self._deadline is None:
+            return future.result()
+        return self._deadline.result(future, url)
+    
+    @contextlib.contextmanager
+    def within_deadline(self, *urls):
+        """Skip the rest of a stage once the time budget is exhausted
+        
+        All endpoints written by the stage are recorded as skipped then.
+        """
+        try:
+            yield
+        except DeadlineExceeded as e:
+            LOGGER.warning("%s", e)
+            for url in (e.url, *urls):
+                self.skip(url)
+    
+    def section(self):
+        """Return the data of the ovirt_agent_status section"""
+        with self._lock:
+            return {
+                "timeout": self._deadline.seconds if self._deadline is not None else None,
+                "skipped": list(self.skipped),
+                "failed": list(self.failed),
+                "stale": dict(self.stale),
+            }
+
+class AgentPerformance:
+    """Wall time, transferred bytes and object counts of API requests and processing stages"""
+    
+    def __init__(self):
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._requests = []
+        self._stages = []
+    
+    def add_request(self, url, seconds, status, size, objects):
+        """Record a finished API request, status is None if no response was received"""
+        with self._lock:
+            self._requests.append({
+                "endpoint": url,
+                "name": endpoint_name(url),
+                "seconds": round(seconds, 3),
+                "status": status,
+                "bytes": size,
+                "objects": objects,
+            })
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a processing stage, the yielded dict takes additional values like objects"""
+        stage = {"name": name}
+        start = time.time()
+        try:
+            yield stage
+        finally:
+            stage["seconds"] = round(time.time() - start, 3)
+            with self._lock:
+                self._stages.append(stage)
+    
+    def section(self):
+        """Return the data of the ovirt_agent_performance section"""
+        with self._lock:
+            return {
+                "runtime": round(time.time() - self._start, 3),
+                "requests": list(self._requests),
+                "stages": list(self._stages),
+            }
+
+def _counted(objects, stage):
+    """Yield the objects and count them in the stage"""
+    stage.setdefault("objects", 0)
+    for obj in objects:
+        stage["objects"] += 1
+        yield obj
+
+class EndpointCache:
+    """Responses of endpoints kept on disk between runs
+    
+    The data of slow-changing endpoints is served while it is younger than
+    their TTL. With max_stale the last good data of every endpoint is kept
+    and served when fetching the endpoint fails.
+    
+    The data derived from the VMs depends on the VM search and the VM
+    statistics of the rule, it is kept apart for every combination.
+    """
+    
+    def __init__(self, cache_dir, engine_url, max_stale=0, vm_search="", statistics=DEFAULT_VM_STATISTICS):
+        key = hashlib.sha256(engine_url.encode("utf-8")).hexdigest()
+        self._dir = Path(cache_dir) / "endpoints" / key
+        self.max_stale = max_stale
+        # Keys of the data that does not only depend on the engine, by endpoint
+        search_scope = scope_key(vm_search)
+        self._scopes = {
+            "snapshots": search_scope,
+            "vm_snapshots": search_scope,
+            "vms": scope_key(vm_search, statistics_option(statistics)),
+        }
+        # Creation time of the data served or stored in this run, by endpoint
+        self._timestamps = {}
+        self._lock = threading.Lock()
+        # Endpoints served from the cache in this run
+        self.served = []
+        # Endpoints served from their last good data in this run
+        self._stale = set()
+        # Endpoints whose cached data is outdated, see EventCursor
+        self.invalidated = set()
+        # Endpoints whose current data was received in this run, stored or not
+        self.refreshed = set()
+    
+    def _path(self, name, suffix=".json"):
+        return self._dir / f"{_scoped(name, self._scopes.get(name))}{suffix}"
+    
+    def load(self, name):
+        """Return the timestamp and data cached for an endpoint, or (None, None)"""
+        try:
+            cached = json.loads(self._path(name).read_text())
+            return cached["timestamp"], cached["data"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, None
+    
+    def get(self, name, ttl):
+        """Return the cached data of an endpoint if it is younger than ttl seconds and not invalidated"""
+        if ttl <= 0 or name in self.invalidated:
+            return None
+        timestamp, data = self.load(name)
+        if timestamp is None or time.time() - timestamp >= ttl:
+            return None
+        LOGGER.debug("Serving %s from the cache", name)
+        self._timestamps[name] = timestamp
+        self.served.append(name)
+        return data
+    
+    def get_stale(self, name):
+        """Return the timestamp and the last good data of an endpoint if it is younger
+        than max_stale seconds, or (None, None)"""
+        if self.max_stale <= 0:
+            return None, None
+        timestamp, data = self.load(name)
+        if timestamp is None or time.time() - timestamp >= self.max_stale:
+            return None, None
+        self._timestamps[name] = timestamp
+        self._stale.add(name)
+        return timestamp, data
+    
+    def store_objects(self, name, objects, reduce=None):
+        """Pass the objects of a collection through while keeping them as its last good data
+        
+        The objects are written to disk one by one, so a large collection is
+        never held in memory. The stored copy is only replaced when all
+        objects were read without an error.
+        """
+        if self.max_stale <= 0:
+            yield from objects
+            return
+        
+        tmp_file = self._path(name, ".jsonl.tmp")
+        try:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            store = tmp_file.open("w")
+        except OSError as e:
+            LOGGER.warning("Cannot keep %s in %s: %s", name, self._dir, e)
+            yield from objects
+            return
+        
+        complete = False
+        try:
+            with store:
+                store.write(json.dumps({"timestamp": time.time()}) + "\n")
+                for obj in objects:
+                    store.write(json.dumps(reduce(obj) if reduce else obj) + "\n")
+                    yield obj
+            complete = True
+        finally:
+            try:
+                if complete:
+                    os.replace(tmp_file, self._path(name, ".jsonl"))
+                else:
+                    tmp_file.unlink(missing_ok=True)
+            except OSError as e:
+                LOGGER.warning("Cannot keep %s in %s: %s", name, self._dir, e)
+    
+    def load_objects(self, name):
+        """Return the timestamp of the last good objects of a collection if they are
+        younger than max_stale seconds, and an iterator over them"""
+        if self.max_stale <= 0:
+            return None, iter(())
+        try:
+            store = self._path(name, ".jsonl").open()
+            timestamp = json.loads(store.readline())["timestamp"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, iter(())
+        
+        if time.time() - timestamp >= self.max_stale:
+            store.close()
+            return None, iter(())
+        
+        def objects():
+            with store:
+                for line in store:
+                    yield json.loads(line)
+        
+        self._timestamps[name] = timestamp
+        self._stale.add(name)
+        return timestamp, objects()
+    
+    def mark_refreshed(self, name):
+        """Record an endpoint whose current data was received, it is no longer invalidated"""
+        with self._lock:
+            self.refreshed.add(name)
+    
+    def put(self, name, data):
+        """Store the data of an endpoint"""
+        timestamp = time.time()
+        self._timestamps[name] = timestamp
+        self.mark_refreshed(name)
+        try:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            tmp_file = self._path(name).with_suffix(".tmp")
+            tmp_file.write_text(json.dumps({"timestamp": timestamp, "data": data}))
+            os.replace(tmp_file, self._path(name))
+        except OSError as e:
+            LOGGER.warning("Cannot cache %s in %s: %s", name, self._dir, e)
+    
+    def drop(self, name):
+        """Remove the stored data of an endpoint, it is no longer invalidated then"""
+        try:
+            self._path(name).unlink(missing_ok=True)
+        except OSError as e:
+            LOGGER.warning("Cannot remove %s from %s: %s", name, self._dir, e)
+        self.mark_refreshed(name)
+    
+    def cache_info(self, name, ttl):
+        """Return (timestamp, interval) of the cached data of an endpoint, or None if it is not cached"""
+        if name in self._stale:
+            return self._timestamps[name], max(ttl, self.max_stale)
+        if ttl <= 0 or name not in self._timestamps:
+            return None
+        return self._timestamps[name], ttl
+
+def _event_code(event):
+    try:
+        return int(event.get("code"))
+    except (TypeError, ValueError):
+        return None
+
+def is_snapshot_event(event):
+    """Return whether an engine event is about a created or removed snapshot
+    
+    Not every engine version uses the same codes, so the description is checked too.
+    """
+    return (_event_code(event) in SNAPSHOT_EVENT_CODES
+            or "snapshot" in str(event.get("description", "")).lower())
+
+def invalidated_endpoints(events):
+    """Return the names of the cached endpoints whose data the engine events changed"""
+    names = set()
+    for event in events:
+        if is_snapshot_event(event):
+            names.add("snapshots")
+        if _event_code(event) in VM_INVENTORY_EVENT_CODES:
+            names.update(("api", "snapshots"))
+        
+        # Other events are assigned by the objects they refer to
+        if "vm" in event:
+            continue
+        if "host" in event:
+            names.update(("api", "hosts"))
+        elif "storage_domain" in event or "data_center" in event:
+            names.update(("api", "datacenters"))
+        elif "cluster" in event:
+            names.add("clusters")
+    return names
+
+class EventCursor:
+    """Position in the event log of an engine, persisted across runs
+    
+    Every run fetches the events since the last seen event and invalidates
+    the cached endpoints they changed. An invalidated endpoint stays
+    invalid until its data was fetched again, also across runs.
+    The ids of VMs whose snapshots changed are kept the same way, see
+    VmSnapshotCache.
+    """
+    
+    def __init__(self, cache_dir, engine_url, vm_search=""):
+        # Every VM search has its own position and changed VMs
+        key = hashlib.sha256(engine_url.encode("utf-8")).hexdigest()
+        self._file = Path(cache_dir) / f"{_scoped(f'events_{key}', scope_key(vm_search))}.json"
+        # Id of the last seen event, None before the first run
+        self.last_id = None
+        self.invalidated = set()
+        self.changed_vms = set()
+        # Events fetched in the current run
+        self.events = []
+        try:
+            state = json.loads(self._file.read_text())
+            self.last_id, self.invalidated = state["last_id"], set(state["invalidated"])
+            self.changed_vms = set(state.get("changed_vms", []))
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    
+    def fetch(self, client):
+        """Fetch the events since the last seen event and invalidate the endpoints they changed
+        
+        Without a last seen event only the position is determined, the
+        engine returns the newest event first, and the snapshots of all VMs
+        are fetched again. Raises EndpointError if the events cannot be fetched.
+        """
+        self.events = []
+        if self.last_id is None:
+            data = client.get_data(f"{EVENTS_ENDPOINT}?max=1")
+            self.invalidated.add("vm_snapshots")
+        else:
+            data = client.get_data(f"{EVENTS_ENDPOINT}?from={self.last_id}&max={EVENTS_MAX}")
+            self.events = data.get("event", [])
+        
+        ids = [int(event["id"]) for event in data.get("event", []) if str(event.get("id", "")).isdigit()]
+        self.last_id = max(ids + [self.last_id or 0])
+        
+        if len(self.events) >= EVENTS_MAX:
+            LOGGER.warning("More than %d events since the last run, refreshing all cached data", EVENTS_MAX)
+            self.invalidated.update(DEFAULT_CACHE_TTLS)
+            self.invalidated.add("vm_snapshots")
+        else:
+            self.invalidated.update(invalidated_endpoints(self.events))
+            self.changed_vms.update(event["vm"]["id"] for event in self.events
+                                    if is_snapshot_event(event) and "id" in event.get("vm", {}))
+        LOGGER.debug("%d new events, invalidated endpoints: %s", len(self.events), sorted(self.invalidated))
+    
+    def save(self, refreshed=()):
+        """Store the position, the endpoints refreshed in this run are valid again"""
+        self.invalidated.difference_update(refreshed)
+        try:
+            self._file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self._file.with_suffix(".tmp")
+            tmp_file.write_text(json.dumps({"last_id": self.last_id, "invalidated": sorted(self.invalidated),
+                                            "changed_vms": sorted(self.changed_vms)}))
+            os.replace(tmp_file, self._file)
+        except OSError as e:
+            LOGGER.warning("Cannot save event position in %s: %s", self._file, e)
+    
+    def section(self):
+        """Return the event position for the ovirt_agent_status section"""
+        return {"last_id": self.last_id, "events": len(self.events), "invalidated": sorted(self.invalidated),
+                "changed_vms": len(self.changed_vms)}
+
+class VmSnapshotCache:
+    """Snapshots of every VM kept on disk, fetched again only for changed VMs
+    
+    VMs named in snapshot events, see EventCursor, and VMs not seen before
+    get their snapshots fetched from /api/vms/{id}/snapshots on the executor
+    while the VMs are processed. Without stored snapshots, the VMs are
+    fetched with their snapshots once and all of them are stored.
+    """
+    
+    def __init__(self, client, cache, executor, changed_vms, status=None):
+        self._client = client
+        self._cache = cache
+        self._executor = executor
+        # Ids of VMs whose snapshots changed, shared with the EventCursor
+        self._changed = changed_vms
+        self._status = status
+        timestamp, snapshots = (None, None) if "vm_snapshots" in cache.invalidated else cache.load("vm_snapshots")
+        # Without stored snapshots the VMs have to be fetched with their snapshots
+        self.loaded = isinstance(snapshots, dict)
+        # Snapshots by VM id, as VM objects with name, type and snapshots
+        self._snapshots = snapshots if self.loaded else {}
+        self._seen = []
+        self._pending = {}
+        # VMs whose stored snapshots could not be fetched again
+        self._outdated = set()
+        # VMs whose snapshots were fetched in this run, no longer changed once stored
+        self._fetched = set()
+        self.complete = False
+    
+    @staticmethod
+    def _reduce(snapshots):
+        return {"snapshot": [{key: snap[key] for key in SNAPSHOT_KEYS if key in snap}
+                             for snap in (snapshots or {}).get("snapshot", [])]}
+    
+    def add(self, vm):
+        """Take the snapshots of a VM, fetched with it, stored or fetched now"""
+        vm_id = vm.get("id")
+        if vm_id is None:
+            return
+        self._seen.append(vm_id)
+        vm_obj = {key: vm[key] for key in ["name", "type"] if key in vm}
+        if "snapshots" in vm or not self.loaded:
+            vm_obj["snapshots"] = self._reduce(vm.get("snapshots"))
+            self._snapshots[vm_id] = vm_obj
+            self._fetched.add(vm_id)
+        elif vm_id in self._snapshots and vm_id not in self._changed:
+            # The name may have changed without a snapshot event
+            self._snapshots[vm_id].update(vm_obj)
+        else:
+            url = f"/api/vms/{vm_id}/snapshots"
+            self._pending[vm_id] = (self._executor.submit(self._client.get_data, url), vm_obj, url)
+    
+    def merged(self):
+        """Return the VM objects with the snapshots of all VMs added, in the order they were added"""
+        for vm_id, (future, vm_obj, url) in self._pending.items():
+            try:
+                vm_obj["snapshots"] = self._reduce(self._client.result(future, url))
+            except (EndpointError, DeadlineExceeded) as e:
+                LOGGER.error("%s", e)
+                if self._status is not None and isinstance(e, DeadlineExceeded):
+                    self._status.skip(url)
+                # The stored snapshots are written once more, but fetched again next run
+                if vm_id in self._snapshots:
+                    self._outdated.add(vm_id)
+                continue
+            self._snapshots[vm_id] = vm_obj
+            self._fetched.add(vm_id)
+        LOGGER.debug("Fetched the snapshots of %d VMs again", len(self._pending))
+        self._pending = {}
+        self.complete = True
+        return [self._snapshots[vm_id] for vm_id in self._seen if vm_id in self._snapshots]
+    
+    def save(self):
+        """Store the snapshots of the VMs seen in this run, the removed VMs are dropped
+        
+        Only to be called with the complete list of VMs, a VM that was not
+        seen is taken as removed. Without saving, the changed VMs stay changed.
+        """
+        if not self.complete:
+            return
+        seen = set(self._seen)
+        self._changed.difference_update(self._fetched)
+        self._changed.intersection_update(seen)
+        self._changed.update(self._outdated)
+        self._cache.put("vm_snapshots", {vm_id: vm_obj for vm_id, vm_obj in self._snapshots.items()
+                                         if vm_id in seen and vm_id not in self._outdated})
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """A request was not sent because the circuit breaker of the engine is open"""
+
+class CircuitBreaker:
+    """Stops sending requests to an engine that keeps failing, persisted across runs
+    
+    After threshold consecutive runs with failed requests the breaker opens
+    and requests fail right away for cool_down seconds. Then requests are
+    sent again, the first success closes the breaker and the first failure
+    opens it again. The requests of a run are sent in parallel, so their
+    outcome is collected during the run and counted once at its end: a run
+    with a failed request counts as failed, even if other requests succeeded.
+    """
+    
+    def __init__(self, cache_dir, engine_url, threshold=DEFAULT_BREAKER_THRESHOLD,
+                 cool_down=DEFAULT_BREAKER_COOL_DOWN):
+        key = hashlib.sha256(engine_url.encode("utf-8")).hexdigest()
+        self._file = Path(cache_dir) / f"breaker_{key}.json"
+        self.threshold = threshold
+        self.cool_down = cool_down
+        self._lock = threading.Lock()
+        self.failures = 0
+        # Time the breaker opened, None while it is closed
+        self.opened = None
+        # Outcome of the requests of the current run
+        self._run_failed = self._run_succeeded = False
+        try:
+            state = json.loads(self._file.read_text())
+            self.failures, self.opened = int(state["failures"]), state["opened"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    
+    def _save(self):
+        try:
+            self._file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self._file.with_suffix(".tmp")
+            tmp_file.write_text(json.dumps({"failures": self.failures, "opened": self.opened}))
+            os.replace(tmp_file, self._file)
+        except OSError as e:
+            LOGGER.warning("Cannot save circuit breaker state in %s: %s", self._file, e)
+    
+    def state(self):
+        """Return "closed", "open" or "half_open" while requests are tried again after the cool-down"""
+        if self.opened is None:
+            return "closed"
+        if time.time() - self.opened < self.cool_down:
+            return "open"
+        return "half_open"
+    
+    def start_run(self):
+        """Start collecting the outcome of the requests of a run"""
+        with self._lock:
+            self._run_failed = self._run_succeeded = False
+    
+    def end_run(self):
+        """Count the run as failed or succeeded, a run without requests is not counted"""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self._run_failed:
+                self.failures += 1
+                if self.failures >= self.threshold and self.state() != "open":
+                    LOGGER.warning("%d consecutive runs with failed requests, opening circuit breaker for %ss",
+                                   self.failures, self.cool_down)
+                    self.opened = time.time()
+                self._save()
+            elif self._run_succeeded and (self.failures or self.opened is not None):
+                if self.opened is not None:
+                    LOGGER.info("Engine responds again, closing circuit breaker")
+                self.failures, self.opened = 0, None
+                self._save()
+    
+    def allow(self):
+        """Return whether a request may be sent"""
+        return self.threshold <= 0 or self.state() != "open"
+    
+    def success(self):
+        with self._lock:
+            self._run_succeeded = True
+    
+    def failure(self):
+        with self._lock:
+            self._run_failed = True
+    
+    def section(self):
+        """Return the breaker state for the ovirt_agent_status section"""
+        with self._lock:
+            return {
+                "state": self.state() if self.threshold > 0 else "disabled",
+                "failures": self.failures,
+                "opened": self.opened,
+                "cool_down": self.cool_down,
+            }
+
+def _capture_path(capture_dir, path):
+    """Return the file of a captured response, named after the endpoint and the full request path"""
+    digest = hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]
+    return Path(capture_dir) / f"{endpoint_name(path)}_{digest}.json"
+
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter saving every raw API response in capture_dir
+    
+    The body is saved as received, the status code and request path in a
+    .meta file next to it. SSO requests are not recorded, so no credentials
+    or tokens end up in a capture.
+    """
+    
+    def __init__(self, capture_dir, engine_url, **kwargs):
+        super().__init__(**kwargs)
+        self._capture_dir = Path(capture_dir)
+        self._engine_url = engine_url
+    
+    def send(self, request, **kwargs):
+        r = super().send(request, **kwargs)
+        path = request.url.removeprefix(self._engine_url)
+        if request.method != "GET" or not path.startswith("/api"):
+            return r
+        
+        # Reading the content here ends streaming, the response is served from memory then
+        body = r.content
+        capture_file = _capture_path(self._capture_dir, path)
+        try:
+            self._capture_dir.mkdir(parents=True, exist_ok=True)
+            capture_file.write_bytes(body)
+            capture_file.with_suffix(".meta").write_text(
+                json.dumps({"path": path, "status": r.status_code}))
+        except OSError as e:
+            LOGGER.warning("Cannot record %s in %s: %s", path, self._capture_dir, e)
+        return r
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter serving the responses recorded by RecordingAdapter instead of an engine
+    
+    Requests without a recorded response get a 404, SSO logins get a dummy token.
+    """
+    
+    def __init__(self, capture_dir, engine_url):
+        super().__init__()
+        self._capture_dir = Path(capture_dir)
+        self._engine_url = engine_url
+    
+    def send(self, request, **kwargs):
+        path = request.url.removeprefix(self._engine_url)
+        r = requests.Response()
+        r.url = request.url
+        r.request = request
+        r.headers["Content-Type"] = "application/json"
+        r.encoding = "utf-8"
+        
+        if path.startswith("/sso/"):
+            r.status_code = 200
+            r._content = json.dumps({"access_token": "replay", "expires_in": 3600}).encode("utf-8")
+        else:
+            capture_file = _capture_path(self._capture_dir, path)
+            try:
+                r.status_code = json.loads(capture_file.with_suffix(".meta").read_text())["status"]
+                r._content = capture_file.read_bytes()
+            except (OSError, ValueError, KeyError):
+                LOGGER.warning("No recorded response for %s in %s", path, self._capture_dir)
+                r.status_code = 404
+                r._content = b'{"fault": {"reason": "Not recorded"}}'
+        
+        r.reason = http.client.responses.get(r.status_code, "")
+        
+        # The whole body is in memory, streamed reads are served from it
+        r._content_consumed = True
+        return r
+    
+    def close(self):
+        pass
+
 class OvirtClient:
     """Client for oVirt API"""
     
     HEADERS = {'Accept': 'application/json', 'Version': '4'}
     
-    def __init__(self, engine_url, username, password, certfile=None):
+    # Renew cached SSO tokens this many seconds before they expire
+    TOKEN_EXPIRY_MARGIN = 60
+    
+    # Size of the chunks read from streamed responses
+    STREAM_CHUNK_SIZE = 64 * 1024
+    
+    # Responses retried as temporary failures
+    RETRY_STATUS = frozenset({429, 502, 503, 504})
+    
+    # Base and maximum delay in seconds between retries, doubled on every attempt
+    RETRY_BACKOFF = 0.5
+    RETRY_BACKOFF_MAX = 8.0
+    
+    def __init__(self, engine_url, username, password, certfile=None, max_connections=DEFAULT_MAX_WORKERS,
+                 use_sso=True, cache_dir=None, performance=None, deadline=None, retries=0, breaker=None,
+                 record_dir=None, replay_dir=None):
         self._engine_url = engine_url
+        self._performance = performance
+        self._deadline = deadline
+        self._retries = retries
+        self._breaker = breaker
         self._auth = (username, password)
         self._certfile = certfile
         self._verify = certfile if certfile else False
+        self._sso = use_sso
+        self._use_sso = use_sso
+        self._token = None
+        self._token_lock = threading.Lock()
+        self._token_file = None
+        # Responses that may still be read, shut down when the time budget is exhausted
+        self._responses = weakref.WeakSet()
+        self._responses_lock = threading.Lock()
+        self._watchdog = None
+        if use_sso and cache_dir:
+            key = hashlib.sha256(f"{engine_url}|{username}".encode("utf-8")).hexdigest()
+            self._token_file = Path(cache_dir) / f"token_{key}.json"
+        self._session = self._create_session(max_connections, record_dir, replay_dir)
+    
+    def _create_session(self, max_connections, record_dir=None, replay_dir=None):
+        """Create a keep-alive session shared by all requests to the engine
+        
+        With record_dir every API response is saved there, with replay_dir
+        the responses saved before are served instead of contacting the engine.
+        """
+        session = requests.Session()
+        if not self._use_sso:
+            session.auth = self._auth
+        session.verify = self._verify
+        session.headers.update(self.HEADERS)
         
+        # One pooled connection per worker, so concurrent requests do not open new connections
+        if replay_dir is not None:
+            adapter = ReplayAdapter(replay_dir, self._engine_url)
+        elif record_dir is not None:
+            adapter = RecordingAdapter(record_dir, self._engine_url, pool_connections=1,
+                                       pool_maxsize=max_connections)
+        else:
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=max_connections,
+            )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # Runs before the body of a response is read
+        session.hooks["response"].append(self._track_response)
+        return session
+    
+    def close(self):
+        """Close all pooled connections"""
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        self._session.close()
+    
+    def start_run(self, performance=None, deadline=None):
+        """Start a new run on the same connections and SSO token, e.g. in the collector"""
+        self._performance = performance
+        self._deadline = deadline
+        self._use_sso = self._sso
+        if self._breaker is not None:
+            self._breaker.start_run()
+        
+        # The request timeout applies to every single read, so a response that
+        # stalls could outlast the time budget, its connection is shut down then
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        if deadline is not None:
+            self._watchdog = threading.Timer(max(deadline.remaining(), 0), self._abort_responses)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+    
+    def _track_response(self, r, *args, **kwargs):
+        with self._responses_lock:
+            self._responses.add(r)
+        return r
+    
+    def _abort_responses(self):
+        """Shut down the connections of all responses, so reads blocked on them return"""
+        with self._responses_lock:
+            responses = list(self._responses)
+            self._responses.clear()
+        for r in responses:
+            try:
+                # urllib3 response -> http.client response -> socket file -> socket
+                sock = r.raw._fp.fp.raw._sock
+            except AttributeError:
+                # Already read completely or not read from a socket
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def remaining(self):
+        """Return the remaining time budget in seconds, or None without a time budget"""
+        if self._deadline is None:
+            return None
+        return max(self._deadline.remaining(), 0)
+    
+    def result(self, future, url):
+        """Wait for a request submitted to an executor within the time budget"""
+        if self._deadline is None:
+            return future.result()
+        return self._deadline.result(future, url)
+    
+    def _timeout(self, url):
+        """Return the timeout for a request, derived from the remaining time budget"""
+        if self._deadline is None:
+            return None
+        return self._deadline.timeout(url.removeprefix(self._engine_url))
+    
+    def _check_deadline(self, url, error):
+        """Raise DeadlineExceeded instead of error if it was caused by the exhausted time budget"""
+        if self._deadline is not None and self._deadline.expired():
+            raise DeadlineExceeded(url) from error
+    
+    def _record(self, url, start, r, size, objects):
+        """Record a request in the agent performance data"""
+        if self._performance is not None:
+            status = r.status_code if r is not None else None
+            self._performance.add_request(url, time.time() - start, status, size, objects)
+        
+    def _load_cached_token(self):
+        """Return the token cached on disk if it is still valid"""
+        if self._token_file is None:
+            return None
+        try:
+            cached = json.loads(self._token_file.read_text())
+            if cached["expires_at"] - self.TOKEN_EXPIRY_MARGIN > time.time():
+                return cached["access_token"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+    
+    def _store_token(self, token, expires_at):
+        """Cache the token on disk, readable by the site user only"""
+        if self._token_file is None:
+            return
+        try:
+            self._token_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self._token_file.with_suffix(".tmp")
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"access_token": token, "expires_at": expires_at}, f)
+            os.replace(tmp_file, self._token_file)
+        except OSError as e:
+            LOGGER.warning("Cannot cache SSO token in %s: %s", self._token_file, e)
+    
+    def _login(self):
+        """Request a new access token from the engine SSO service"""
+        username, password = self._auth
+        start = time.time()
+        r = self._session.post(
+            self._engine_url + "/sso/oauth/token",
+            data={
+                "grant_type": "password",
+                "scope": "ovirt-app-api",
+                "username": username,
+                "password": password,
+            },
+            timeout=self._timeout("/sso/oauth/token"),
+        )
+        self._record("/sso/oauth/token", start, r, len(r.content), None)
+        r.raise_for_status()
+        token_data = r.json()
+        if "error" in token_data:
+            raise ValueError(token_data.get("error_description", token_data["error"]))
+        
+        # Depending on the engine version the lifetime is sent as "expires_in"
+        # (seconds) or as "exp" (epoch milliseconds)
+        if "expires_in" in token_data:
+            expires_at = time.time() + int(token_data["expires_in"])
+        else:
+            expires_at = int(token_data["exp"]) / 1000
+        
+        self._store_token(token_data["access_token"], expires_at)
+        return token_data["access_token"]
+    
+    def _get_token(self, rejected=None):
+        """Return a valid SSO token, or None to fall back to basic authentication"""
+        with self._token_lock:
+            if self._token is not None and self._token != rejected:
+                return self._token
+            
+            if rejected is None and self._token is None:
+                self._token = self._load_cached_token()
+                if self._token is not None:
+                    LOGGER.debug("Using cached SSO token")
+                    return self._token
+            
+            try:
+                self._token = self._login()
+                LOGGER.debug("Obtained new SSO token")
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                LOGGER.warning("SSO login failed, falling back to basic authentication: %s", e)
+                self._use_sso = False
+                self._token = None
+            return self._token
+    
+    def _send_get(self, url, stream=False):
+        """Send a GET request, authenticated with the SSO token if possible"""
+        if self._use_sso:
+            token = self._get_token()
+            if token is not None:
+                r = self._session.get(url, headers={"Authorization": f"Bearer {token}"}, stream=stream,
+                                      timeout=self._timeout(url))
+                if r.status_code != 401:
+                    return r
+                r.close()
+                
+                LOGGER.info("SSO token was rejected, logging in again")
+                token = self._get_token(rejected=token)
+                if token is not None:
+                    return self._session.get(url, headers={"Authorization": f"Bearer {token}"},
+                                             stream=stream, timeout=self._timeout(url))
+        
+        return self._session.get(url, auth=self._auth, stream=stream, timeout=self._timeout(url))
+    
+    def _backoff(self, attempt):
+        """Return the jittered delay before a retry, or None if it would exceed the time budget"""
+        delay = random.uniform(0, min(self.RETRY_BACKOFF * 2 ** attempt, self.RETRY_BACKOFF_MAX))
+        if self._deadline is not None and delay >= self._deadline.remaining():
+            return None
+        return delay
+    
+    def _get(self, url, stream=False):
+        """Send a GET request, retried with exponential backoff on temporary failures
+        
+        Connection errors, timeouts and server errors count as failures of the
+        engine for the circuit breaker, except timeouts caused by the exhausted
+        time budget of the run. While the breaker is open, no request is sent
+        and CircuitOpenError is raised.
+        """
+        if self._breaker is not None and not self._breaker.allow():
+            raise CircuitOpenError(f"Circuit breaker is open, not sending {url}")
+        
+        attempt = 0
+        while True:
+            try:
+                r = self._send_get(url, stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                r, error = None, e
+            else:
+                error = None
+                if r.status_code not in self.RETRY_STATUS:
+                    if self._breaker is not None:
+                        if r.status_code >= 500:
+                            self._breaker.failure()
+                        else:
+                            self._breaker.success()
+                    return r
+            
+            delay = self._backoff(attempt) if attempt < self._retries else None
+            if delay is None:
+                if self._breaker is not None and not (self._deadline is not None and self._deadline.expired()):
+                    self._breaker.failure()
+                if error is not None:
+                    raise error
+                return r
+            
+            if r is not None:
+                r.close()
+            attempt += 1
+            LOGGER.info("Retrying %s in %.1fs (%d/%d): %s", url, delay, attempt, self._retries,
+                        error or r.status_code)
+            time.sleep(delay)
+    
     def get_data(self, url):
-        """Fetch data from API endpoint"""
+        """Fetch data from API endpoint
+        
+        Raises EndpointError if the request fails and DeadlineExceeded if the
+        time budget of the run is exhausted.
+        """
+        start = time.time()
+        r = None
         try:
-            r = requests.get(
-                self._engine_url + url,
-                auth=self._auth, 
-                verify=self._verify, 
-                headers=self.HEADERS
-            )
+            r = self._get(self._engine_url + url)
             r.raise_for_status()
-            return r.json()
+            data = r.json()
         except requests.exceptions.RequestException as e:
-            LOGGER.error("Error fetching %s: %s", url, e)
+            self._record(url, start, r, 0, 0)
+            self._check_deadline(url, e)
+            raise EndpointError(url, e) from e
+        
+        self._record(url, start, r, len(r.content), _count_objects(data))
+        return data
+    
+    def _open_stream(self, url):
+        """Send the request for an endpoint and return the start time and the response
+        before its body is read, or the exception if the request failed"""
+        start = time.time()
+        r = None
+        try:
+            r = self._get(self._engine_url + url, stream=True)
+            r.raise_for_status()
+            return start, r
+        except requests.exceptions.RequestException as e:
+            self._record(url, start, r, 0, 0)
+            if r is not None:
+                r.close()
+            return start, e
+    
+    def _iter_objects(self, open_response, url, key):
+        """Decode the objects of a collection one by one from a streamed response
+        
+        Raises EndpointError if the request fails or the response is
+        incomplete, the objects yielded before are valid.
+        """
+        start, r = open_response()
+        if isinstance(r, Exception):
+            self._check_deadline(url, r)
+            raise EndpointError(url, r) from r
+        
+        size = 0
+        objects = 0
+        
+        def chunks():
+            nonlocal size
+            for chunk in r.iter_content(self.STREAM_CHUNK_SIZE):
+                # The request timeout applies to every read, so check the budget in between
+                if self._deadline is not None and self._deadline.expired():
+                    raise DeadlineExceeded(url)
+                size += len(chunk)
+                yield chunk
+        
+        try:
+            with r:
+                for obj in iter_json_array(chunks(), key):
+                    objects += 1
+                    yield obj
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._check_deadline(url, e)
+            raise EndpointError(url, e) from e
+        finally:
+            self._record(url, start, r, size, objects)
+    
+    def stream_objects(self, url, key, executor=None):
+        """Return an iterator over the objects of a collection, decoded while the response arrives
+        
+        With an executor the request is sent right away, otherwise when the
+        iteration starts.
+        """
+        if executor is not None:
+            return self._iter_objects(
+                functools.partial(self.result, executor.submit(self._open_stream, url), url), url, key)
+        return self._iter_objects(functools.partial(self._open_stream, url), url, key)
+    
+    def get_collection(self, url, key, reduce=None):
+        """Fetch a collection, reducing every object as soon as it is decoded
+        
+        Raises EndpointError if the collection cannot be fetched completely.
+        """
+        objects = [reduce(obj) if reduce else obj for obj in self.stream_objects(url, key)]
+        return {key: objects} if objects else {}
+    
+    def iter_pages(self, url, key, page_size, executor=None, search=""):
+        """Yield the objects of a collection page by page using the search paging of the API
+        
+        With an executor the next page is requested while the current one is processed,
+        so at most two pages are held in memory. The objects can be filtered
+        with a search expression. Raises EndpointError if a page cannot be
+        fetched.
+        """
+        separator = "&" if "?" in url else "?"
+        
+        def fetch_page(page):
+            page_search = quote(f"{search} sortby name page {page}".strip())
+            return self.get_data(f"{url}{separator}max={page_size}&search={page_search}")
+        
+        page = 1
+        next_page = executor.submit(fetch_page, page) if executor else None
+        while True:
+            data = self.result(next_page, url) if executor else fetch_page(page)
+            objects = data.get(key, [])
+            
+            if executor and len(objects) >= page_size:
+                next_page = executor.submit(fetch_page, page + 1)
+            
+            LOGGER.debug("Fetched page %d of %s with %d objects", page, url, len(objects))
+            yield objects
+            
+            if len(objects) < page_size:
+                return
+            page += 1
+
+class AgentOutput:
+    """Agent output written with a few large writes
+    
+    Sections are rendered like SectionWriter does. With a stream, they are
+    written in the order they are added as soon as WRITE_SIZE is reached,
+    consecutive sections of the same piggyback target, e.g. of one VM, share
+    the target header. Memory then stays flat however large the inventory
+    is. Without a stream, all sections are kept grouped by piggyback target
+    until write(), which is needed to merge the outputs of several engines.
+    """
+    
+    # Approximate size of a single write to the output stream
+    WRITE_SIZE = 1024 * 1024
+    
+    def __init__(self, stream=None):
+        self._stream = stream
+        # Rendered sections by piggyback target, None for the sections of the engine itself
+        self._sections = {None: []}
+        # Rendered text not written to the stream yet and the piggyback target it ends in
+        self._pending = []
+        self._pending_size = 0
+        self._target = None
+    
+    def _append(self, text):
+        self._pending.append(text)
+        self._pending_size += len(text)
+    
+    def _write_pending(self):
+        if self._pending:
+            self._stream.write("".join(self._pending))
+            self._pending, self._pending_size = [], 0
+    
+    def add_json(self, name, data, piggytarget=None):
+        """Add a section containing data as a single line of JSON"""
+        section = f"<<<{name}:sep(0)>>>\n{json.dumps(data, sort_keys=True)}\n"
+        if self._stream is None:
+            self._sections.setdefault(piggytarget, []).append(section)
+            return
+        
+        if piggytarget != self._target:
+            if self._target is not None:
+                self._append("<<<<>>>>\n")
+            if piggytarget is not None:
+                self._append(f"<<<<{piggytarget}>>>>\n")
+            self._target = piggytarget
+        self._append(section)
+        if self._pending_size >= self.WRITE_SIZE:
+            self._write_pending()
+    
+    def render(self):
+        """Yield the output, piggyback data after the sections of the engine itself"""
+        yield from self._sections[None]
+        for piggytarget, sections in self._sections.items():
+            if piggytarget is None:
+                continue
+            yield f"<<<<{piggytarget}>>>>\n"
+            yield from sections
+            yield "<<<<>>>>\n"
+    
+    def add_output(self, other, piggytarget=None):
+        """Add all sections of another output, its own sections as piggyback data of piggytarget"""
+        for target, sections in other._sections.items():
+            self._sections.setdefault(piggytarget if target is None else target, []).extend(sections)
+    
+    def write(self, stream):
+        """Write the output to stream in chunks of about WRITE_SIZE characters
+        
+        With a stream given to the constructor, only the rest not written yet
+        is written to it.
+        """
+        if self._stream is not None:
+            if self._target is not None:
+                self._append("<<<<>>>>\n")
+                self._target = None
+            self._write_pending()
+            self._stream.flush()
+            return
+        
+        chunk, size = [], 0
+        for text in self.render():
+            chunk.append(text)
+            size += len(text)
+            if size >= self.WRITE_SIZE:
+                stream.write("".join(chunk))
+                chunk, size = [], 0
+        if chunk:
+            stream.write("".join(chunk))
+        stream.flush()
+
+def section_name(name, cache_info=None):
+    """Return the section name, with the cached() option for data reused across runs"""
+    if cache_info is None:
+        return name
+    timestamp, interval = cache_info
+    return f"{name}:cached({int(timestamp)},{int(interval)})"
+
+def _combined_cache_info(*cache_infos):
+    """Return the cache info of a section built from several endpoints, as old as its
+    oldest cached endpoint, None if all endpoints are fresh"""
+    cache_infos = [cache_info for cache_info in cache_infos if cache_info is not None]
+    if not cache_infos:
+        return None
+    return min(timestamp for timestamp, _ in cache_infos), max(interval for _, interval in cache_infos)
+
+def _reduce_host(host):
+    """Keep only the host attributes used by the agent"""
+    return {key: host[key] for key in HOST_KEYS if host and key in host}
+
+def _reduce_datacenter(datacenter):
+    """Keep only the datacenter and storage domain attributes used by the agent"""
+    if not datacenter:
+        return datacenter
+    
+    datacenter_obj = {key: datacenter[key] for key in DATACENTER_KEYS if key in datacenter}
+    datacenter_obj["storage_domains"] = {"storage_domain": [
+        {key: storage_domain[key] for key in STORAGE_DOMAIN_KEYS if key in storage_domain}
+        for storage_domain in datacenter.get("storage_domains", {}).get("storage_domain", [])
+        if storage_domain
+    ]}
+    return datacenter_obj
+
+def search_url(url, search):
+    """Return the URL of a collection filtered by an oVirt search expression"""
+    if not search:
+        return url
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}search={quote(search)}"
+
+def _reduce_vm(vm, statistics=DEFAULT_VM_STATISTICS):
+    """Keep only the VM attributes and the statistics used by the agent"""
+    vm_obj = {key: vm[key] for key in ["id", "name", "type", "status"] if key in vm}
+    if "statistics" in vm:
+        vm_obj["statistics"] = {"statistic": [
+            {key: stat[key] for key in ["name", "type", "unit", "description", "values"] if key in stat}
+            for stat in vm["statistics"].get("statistic", [])
+            if stat.get("name") in statistics
+        ]}
+    if "snapshots" in vm:
+        vm_obj["snapshots"] = vm["snapshots"]
+    return vm_obj
+
+def _join_search(*terms):
+    """Return a search expression matching all terms"""
+    return " ".join(term for term in terms if term)
+
+def iter_running_first(running, others):
+    """Chain the running VMs and the other VMs, every VM only once
+    
+    Both come from separate requests, a VM that starts or stops in between
+    is only taken from the first one.
+    """
+    seen = set()
+    for vm in itertools.chain(running, others):
+        vm_id = vm.get("id")
+        if vm_id is not None:
+            if vm_id in seen:
+                continue
+            seen.add(vm_id)
+        yield vm
+
+def _cluster_search(name, search=""):
+    """Return the search expression selecting the VMs of a cluster"""
+    if re.search(r"\s", name):
+        name = f'"{name}"'
+    return f"cluster={name} {search}".strip()
+
+def iter_vms_by_cluster(client, url, clusters_future, executor, max_in_flight, page_size=0, search="",
+                        reduce=_reduce_vm):
+    """Yield the VMs cluster by cluster, fetching up to max_in_flight clusters in parallel
+    
+    Several small searches spread the work over the engine, and the VMs of
+    every cluster are processed while the others are still fetched, in the
+    order the clusters complete. Without clusters all VMs are fetched at once.
+    If the VMs of a cluster cannot be fetched, EndpointError is raised after
+    the VMs of all other clusters, so only the VMs of the failed cluster are
+    missing.
+    """
+    clusters = [cluster["name"] for cluster in client.result(clusters_future, "/api/clusters").get("cluster", [])
+                if cluster and "name" in cluster]
+    searches = [_cluster_search(name, search) for name in clusters] if clusters else [search]
+    
+    def fetch_cluster(cluster_search):
+        if page_size:
+            return [reduce(vm) for page in client.iter_pages(url, "vm", page_size, search=cluster_search)
+                    for vm in page]
+        return client.get_collection(search_url(url, cluster_search), "vm", reduce).get("vm", [])
+    
+    pending = iter(searches)
+    in_flight = set()
+    error = None
+    while True:
+        for cluster_search in itertools.islice(pending, max_in_flight - len(in_flight)):
+            in_flight.add(executor.submit(fetch_cluster, cluster_search))
+        if not in_flight:
+            break
+        done, in_flight = wait(in_flight, timeout=client.remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded(url)
+        for future in done:
+            try:
+                vms = future.result()
+            except EndpointError as e:
+                if error is not None:
+                    LOGGER.error("%s", e)
+                error = error or e
+                continue
+            yield from vms
+    if error is not None:
+        raise error
+
+# Large collections that are decoded incrementally: endpoint -> (array key, reduce function)
+STREAMED_COLLECTIONS = {
+    HOSTS_ENDPOINT: ("host", _reduce_host),
+    DATACENTERS_ENDPOINT: ("data_center", _reduce_datacenter),
+}
+
+def _fetch_endpoint(client, url, cache=None, name=None, ttl=0, status=None):
+    """Fetch an endpoint, served from the cache while the cached data is fresh
+    
+    If fetching fails, the last good data of the endpoint is served and
+    marked as stale in status, as long as it is not too old.
+    """
+    if cache is not None:
+        data = cache.get(name, ttl)
+        if data is not None:
+            return data
+    
+    try:
+        if url in STREAMED_COLLECTIONS:
+            key, reduce = STREAMED_COLLECTIONS[url]
+            data = client.get_collection(url, key, reduce)
+        else:
+            data = client.get_data(url)
+    except EndpointError as e:
+        LOGGER.error("%s", e)
+        timestamp, data = cache.get_stale(name) if cache is not None else (None, None)
+        if timestamp is None:
+            if status is not None:
+                status.fail(url)
             return {}
+        LOGGER.warning("Serving the last good data of %s from %s", name, time.ctime(timestamp))
+        if status is not None:
+            status.mark_stale(name, timestamp)
+        return data
+    
+    if cache is not None:
+        cache.mark_refreshed(name)
+        if (ttl > 0 or cache.max_stale > 0) and data:
+            cache.put(name, data)
+    return data
+
+def fetch_endpoints(client, endpoints, executor, cache=None, cache_ttls=None, status=None):
+    """Submit all endpoint fetches to the executor, keyed by endpoint URL"""
+    cache_ttls = cache_ttls or {}
+    return {
+        url: executor.submit(_fetch_endpoint, client, url, cache, name, cache_ttls.get(name, 0), status)
+        for name, url in endpoints.items()
+    }
+
+def _vms_with_fallback(vms, cache, status=None, reduce=_reduce_vm):
+    """Pass the VMs through while keeping them as last good data
+    
+    If fetching the VMs fails, also partway through, the VMs not received
+    yet are served from the last good data and marked as stale in status.
+    Without last good data the VMs are recorded as failed in status.
+    """
+    seen = set()
+    try:
+        for vm in cache.store_objects("vms", vms, reduce):
+            seen.add(vm.get("id"))
+            yield vm
+    except EndpointError as e:
+        LOGGER.error("%s", e)
+        timestamp, stale_vms = cache.load_objects("vms")
+        if timestamp is None:
+            if status is not None:
+                status.fail(e.url)
+            return
+        LOGGER.warning("Serving the last good data of vms from %s", time.ctime(timestamp))
+        if status is not None:
+            status.mark_stale("vms", timestamp)
+        for vm in stale_vms:
+            if vm.get("id") not in seen:
+                yield vm
 
-def process_hosts_data(hosts_data, generate_piggyback=True):
+@time_it
+def process_hosts_data(output, hosts_data, generate_piggyback=True, cache_info=None):
     """Process hosts data and create piggyback data if needed"""
     if not hosts_data or "host" not in hosts_data:
         return
@@ -117,203 +1827,581 @@ def process_hosts_data(hosts_data, generate_piggyback=True):
     # Create piggyback data for each host
     if generate_piggyback:
         for host in hosts_data["host"]:
-            host_obj = {}
-            for key in ["version", "status", "summary", "type", "name", "libvirt_version", "hosted_engine"]:
-                if host and key in host:
-                    host_obj[key] = host[key]
+            host_obj = _reduce_host(host)
             
-            with SectionWriter(f"ovirt_hosts", piggytarget=host_obj["name"]) as w:
-                w.append_json(host_obj)
+            output.add_json(section_name("ovirt_hosts", cache_info), host_obj, piggytarget=host_obj["name"])
 
-def process_vms_stats(vms_data, generate_piggyback=True):
-    """Process VM statistics data and create piggyback data if needed"""
-    if not generate_piggyback or not vms_data or "vm" not in vms_data:
+def process_vm_stats(output, vm, generate_piggyback=True, statistics=DEFAULT_VM_STATISTICS, cache_info=None):
+    """Process the selected statistics of a single VM and create piggyback data if needed"""
+    if not generate_piggyback:
         return
     
-    for vm in vms_data['vm']:
-        vm_obj = {}
-        
-        for key in ["name", "type"]:
-            if vm and key in vm:
-                vm_obj[key] = vm[key]
-        
-        if "statistics" in vm and "statistic" in vm["statistics"]:
-            for stat in vm["statistics"]["statistic"]:
-                if stat["name"] not in ["network.current.total", "cpu.current.total", 
-                                       "cpu.current.hypervisor", "cpu.current.guest", 
-                                       "memory.installed"]:
-                    continue
-                stat_obj = {k: v for k, v in stat.items() if k in [
-                    "name", "type", "unit", "description"]}
-                for _, value in stat["values"]["value"][0].items():
-                    stat_obj["value"] = str(value)
-                vm_obj.setdefault("statistics", []).append(stat_obj)
-        
-        with SectionWriter(f"ovirt_vmstats", piggytarget=vm_obj["name"]) as w:
-            w.append_json(vm_obj)
-
-def process_vms_snapshots(vms_data, generate_piggyback=True):
-    """Process VM snapshots data and create piggyback data if needed"""
-    if not vms_data or "vm" not in vms_data:
-        return
+    vm_obj = {}
+    
+    for key in ["name", "type"]:
+        if vm and key in vm:
+            vm_obj[key] = vm[key]
+    
+    # VMs fetched without statistics because they are not running
+    if "statistics" not in vm and "status" in vm:
+        vm_obj["status"] = vm["status"]
+    
+    if "statistics" in vm and "statistic" in vm["statistics"]:
+        for stat in vm["statistics"]["statistic"]:
+            if stat["name"] not in statistics:
+                continue
+            stat_obj = {k: v for k, v in stat.items() if k in [
+                "name", "type", "unit", "description"]}
+            # Some statistics, e.g. of the guest agent, can be sent without values
+            for value in stat.get("values", {}).get("value", [])[:1]:
+                for _, datum in value.items():
+                    stat_obj["value"] = str(datum)
+            vm_obj.setdefault("statistics", []).append(stat_obj)
+    
+    output.add_json(section_name("ovirt_vmstats", cache_info), vm_obj, piggytarget=vm_obj["name"])
+
+def _write_vm_snapshots(output, vm_obj, generate_piggyback=True, cache_info=None):
+    """Create the piggyback snapshot data of a single VM if needed"""
+    if generate_piggyback and "name" in vm_obj:
+        output.add_json(section_name("ovirt_snapshots", cache_info), vm_obj, piggytarget=vm_obj["name"])
+
+def process_vm_snapshots(output, vm, generate_piggyback=True, cache_info=None):
+    """Process the snapshots of a single VM and create piggyback data if needed"""
+    vm_obj = {}
+    
+    for key in ["name", "type"]:
+        if vm and key in vm:
+            vm_obj[key] = vm[key]
+    
+    if "snapshots" in vm and "snapshot" in vm["snapshots"]:
+        for snap in vm["snapshots"]["snapshot"]:
+            vm_obj.setdefault("snapshots", []).append({k: v for k, v in snap.items() if k in SNAPSHOT_KEYS})
     
+    # Create piggyback data for each VM
+    _write_vm_snapshots(output, vm_obj, generate_piggyback, cache_info)
+    
+    return vm_obj
+
+@time_it
+def process_vms(output, vms, generate_piggyback=True, cached_snapshots=None, snapshots_cache_info=None,
+                statistics=DEFAULT_VM_STATISTICS, vm_snapshots=None, vms_cache_info=None, vms_complete=None):
+    """Process VM statistics and snapshots in a single pass over the VMs
+    
+    VMs may be any iterable, e.g. a generator over paged API responses, so
+    only the VMs currently processed have to be kept in memory. If
+    cached_snapshots is given, the VMs were fetched without snapshots and the
+    cached snapshot data is written instead. With snapshots_cache_info the
+    snapshot sections are written with the cached() option. With a
+    VmSnapshotCache the snapshots are written from it after all VMs.
+    vms_cache_info returns the cache info of the VM just received, which is
+    not None for VMs served from their last good data. If vms_complete
+    returns False after the VMs, some VMs are missing and the engine-wide
+    snapshot section is not written.
+    
+    Returns the snapshot data of all VMs, None if the VMs are incomplete.
+    """
     # Create main section for all snapshots
     snapshots_data = []
+    # Cache info of the last good data, once VMs are served from it
+    stale_info = None
+    stale_names = set()
     
-    for vm in vms_data['vm']:
-        vm_obj = {}
-        
-        for key in ["name", "type"]:
-            if vm and key in vm:
-                vm_obj[key] = vm[key]
+    for vm in vms:
+        vm_cache_info = vms_cache_info() if vms_cache_info is not None else None
+        if vm_cache_info is not None:
+            stale_info = vm_cache_info
+            stale_names.add(vm.get("name"))
+        process_vm_stats(output, vm, generate_piggyback, statistics, vm_cache_info)
+        if vm_snapshots is not None:
+            vm_snapshots.add(vm)
+        elif cached_snapshots is None:
+            snapshots_data.append(process_vm_snapshots(output, vm, generate_piggyback,
+                                                       vm_cache_info or snapshots_cache_info))
+    
+    if vm_snapshots is not None:
+        for vm in vm_snapshots.merged():
+            snapshots_data.append(process_vm_snapshots(
+                output, vm, generate_piggyback, stale_info if vm.get("name") in stale_names else None))
+    
+    if cached_snapshots is not None:
+        snapshots_data = cached_snapshots
+        for vm_obj in snapshots_data:
+            _write_vm_snapshots(output, vm_obj, generate_piggyback, snapshots_cache_info)
+    
+    if vms_complete is not None and not vms_complete():
+        return None
+    
+    if not snapshots_data:
+        return snapshots_data
+    
+    # Write the main section with all snapshots, as old as its oldest data
+    engine_cache_info = snapshots_cache_info
+    if stale_info is not None and cached_snapshots is None:
+        engine_cache_info = _combined_cache_info(stale_info, snapshots_cache_info)
+    output.add_json(section_name("ovirt_snapshots_engine", engine_cache_info), snapshots_data)
+    
+    return snapshots_data
+
+def _write_overview_and_hosts(output, api_data, hosts_data, generate_piggyback=True, hosts_cache_info=None,
+                              overview_cache_info=None):
+    """Write the overview section and the piggyback data of the hosts"""
+    # Write overview section
+    overview_data = {}
+    for key in ["product_info", "summary"]:
+        if api_data and key in api_data:
+            overview_data.setdefault("api", {})[key] = api_data[key]
+    
+    # Check for global maintenance
+    overview_data["global_maintenance"] = False
+    if hosts_data and "host" in hosts_data:
+        for host in hosts_data["host"]:
+            if ("hosted_engine" in host and host["hosted_engine"] and 
+                "global_maintenance" in host["hosted_engine"] and 
+                host["hosted_engine"]["global_maintenance"] == "true"):
+                overview_data["global_maintenance"] = True
+                break
+    
+    output.add_json(section_name("ovirt_overview", overview_cache_info), overview_data)
+    
+    # Process hosts data
+    process_hosts_data(output, hosts_data, generate_piggyback, hosts_cache_info)
+
+def _write_datacenters(output, datacenters_data, cache_info=None):
+    """Write the datacenter and storage domain sections, return the datacenters"""
+    data_center_result = {"datacenters": []}
+    storage_domain_result = {"storage_domains": []}
+    
+    if datacenters_data and "data_center" in datacenters_data:
+        for datacenter in datacenters_data["data_center"]:
+            if not datacenter:
+                continue
+            
+            datacenter_obj = {key: datacenter[key] for key in DATACENTER_KEYS if key in datacenter}
+            
+            data_center_result["datacenters"].append(datacenter_obj)
+            
+            for storage_domain in datacenter.get("storage_domains", {}).get("storage_domain", []):
+                if not storage_domain:
+                    continue
+                
+                storage_domain_obj = {}
+                storage_domain_obj.setdefault("data_center", {})["name"] = datacenter["name"]
+                storage_domain_obj.setdefault("data_center", {})["id"] = datacenter["id"]
+                
+                for key in STORAGE_DOMAIN_KEYS:
+                    if key in storage_domain:
+                        storage_domain_obj[key] = storage_domain[key]
+                
+                storage_domain_result["storage_domains"].append(storage_domain_obj)
+    
+    output.add_json(section_name("ovirt_datacenters", cache_info), data_center_result)
+    
+    output.add_json(section_name("ovirt_storage_domains", cache_info), storage_domain_result)
+    
+    return data_center_result["datacenters"]
+
+def _write_clusters(output, clusters_data, cache_info=None):
+    """Write the cluster section, return the clusters"""
+    cluster_result = {"cluster": []}
+    
+    if clusters_data and "cluster" in clusters_data:
+        for cluster in clusters_data["cluster"]:
+            if not cluster:
+                continue
+            
+            cluster_obj = {}
+            for key in ["id", "version", "description", "name"]:
+                if key in cluster:
+                    cluster_obj[key] = cluster[key]
+            
+            cluster_obj.setdefault("data_center", {})["id"] = cluster.get(
+                "data_center", {}).get("id", None)
+            
+            cluster_result["cluster"].append(cluster_obj)
+    
+    output.add_json(section_name("ovirt_clusters", cache_info), cluster_result)
+    
+    return cluster_result["cluster"]
+
+def _write_sections(output, futures, vms, generate_piggyback=True, cache=None, cache_ttls=None,
+                    cached_snapshots=None, performance=None, status=None, statistics=DEFAULT_VM_STATISTICS,
+                    vm_snapshots=None):
+    """Write all sections in a fixed order as the fetched endpoints become available
+    
+    Sections built from cached endpoints carry the cached() option, so Checkmk
+    shows the real age of their data. The time spent in every stage, including
+    waiting for its endpoints, is recorded in performance. Once the time budget
+    is exhausted, the remaining stages are skipped and recorded in status, all
+    sections completed so far are kept.
+    """
+    cache_ttls = cache_ttls or {}
+    performance = performance or AgentPerformance()
+    status = status or AgentStatus()
+    
+    def cache_info(name):
+        return cache.cache_info(name, cache_ttls.get(name, 0)) if cache is not None else None
+    
+    api_data = datacenters = clusters = None
+    
+    with performance.stage("hosts") as stage, status.within_deadline("/api", HOSTS_ENDPOINT):
+        api_data = status.result(futures["/api"], "/api")
+        hosts_data = status.result(futures[HOSTS_ENDPOINT], HOSTS_ENDPOINT)
+        stage["objects"] = len(hosts_data.get("host", []))
+        _write_overview_and_hosts(output, api_data, hosts_data, generate_piggyback, cache_info("hosts"),
+                                  _combined_cache_info(cache_info("api"), cache_info("hosts")))
+    
+    with performance.stage("datacenters") as stage, status.within_deadline(DATACENTERS_ENDPOINT):
+        datacenters = _write_datacenters(
+            output, status.result(futures[DATACENTERS_ENDPOINT], DATACENTERS_ENDPOINT), cache_info("datacenters"))
+        stage["objects"] = len(datacenters)
+    
+    with performance.stage("clusters") as stage, status.within_deadline("/api/clusters"):
+        clusters = _write_clusters(output, status.result(futures["/api/clusters"], "/api/clusters"),
+                                   cache_info("clusters"))
+        stage["objects"] = len(clusters)
+    
+    # Fetch VMs once with statistics and snapshots and process both together
+    snapshots_ttl = cache_ttls.get("snapshots", 0)
+    if vm_snapshots is not None:
+        # Kept up to date by the engine events
+        snapshots_cache_info = None
+    elif cached_snapshots is not None:
+        snapshots_cache_info = cache_info("snapshots")
+    else:
+        # Freshly fetched snapshots are reused from now on
+        snapshots_cache_info = (time.time(), snapshots_ttl) if cache is not None and snapshots_ttl > 0 else None
+    
+    # VMs received before the time budget is exhausted still get their piggyback
+    # data, the engine wide snapshot section is only written for all VMs
+    snapshots_data = None
+    with performance.stage("vms") as stage, status.within_deadline():
+        snapshots_data = process_vms(output, _counted(vms, stage), generate_piggyback, cached_snapshots,
+                                     snapshots_cache_info, statistics, vm_snapshots,
+                                     functools.partial(cache_info, "vms") if cache is not None else None,
+                                     functools.partial(status.complete, "vms"))
+    # A VM missing from an incomplete list would be taken as removed
+    if vm_snapshots is not None and "vms" not in status.stale and status.complete("vms"):
+        vm_snapshots.save()
+    if (snapshots_cache_info is not None and cached_snapshots is None and snapshots_data
+            and "vms" not in status.stale):
+        cache.put("snapshots", snapshots_data)
+    elif (cache is not None and vm_snapshots is None and cached_snapshots is None and snapshots_data is not None
+            and "vms" not in status.stale):
+        # Snapshots fetched with all VMs are current, also without a snapshots TTL
+        cache.mark_refreshed("snapshots")
+    
+    if api_data is None or datacenters is None or clusters is None:
+        return
+    
+    # Write compatibility information
+    compatibility_result = {}
+    if api_data and "product_info" in api_data:
+        compatibility_result["engine"] = api_data["product_info"]
+    
+    compatibility_result["datacenters"] = datacenters
+    compatibility_result["cluster"] = clusters
+    
+    compatibility_cache_info = _combined_cache_info(
+        cache_info("api"), cache_info("datacenters"), cache_info("clusters"))
+    output.add_json(section_name("ovirt_compatibility", compatibility_cache_info), compatibility_result)
+
+def _lookup_password(reference):
+    """Return a password from the CMK password store, referenced as id:path"""
+    pw_id, pw_path = reference.split(":")
+    return password_store.lookup(Path(pw_path), pw_id)
+
+def _engine_capture_dir(capture_dir, name=None):
+    """Return the capture directory of an engine, additional engines get a subdirectory"""
+    if capture_dir is None or name is None:
+        return capture_dir
+    return capture_dir / name
+
+class EngineCollector:
+    """Collects the sections of a single engine, keeping the connections and the
+    SSO token between runs"""
+    
+    def __init__(self, args, engine_url, username, password, certfile=None, name=None):
+        self._args = args
+        self._engine_url = engine_url
+        # Unselected statistics are dropped as soon as a VM is decoded
+        self._reduce_vm = functools.partial(_reduce_vm, statistics=args.vm_statistics)
+        self._breaker = CircuitBreaker(args.cache_dir, engine_url, args.breaker_threshold,
+                                       args.breaker_cool_down)
+        self._cursor = EventCursor(args.cache_dir, engine_url, args.vm_search) if args.events else None
+        self._client = OvirtClient(
+            engine_url=engine_url,
+            username=username,
+            password=password,
+            certfile=certfile,
+            max_connections=args.max_workers,
+            use_sso=not args.basic_auth,
+            cache_dir=args.cache_dir,
+            retries=args.retries,
+            breaker=self._breaker,
+            record_dir=_engine_capture_dir(args.record, name),
+            replay_dir=_engine_capture_dir(args.replay, name),
+        )
+    
+    def close(self):
+        self._client.close()
+    
+    def _iter_vms(self, url, search, executor, futures):
+        """Return an iterator over the VMs of url matching the search expression
         
-        if "snapshots" in vm and "snapshot" in vm["snapshots"]:
-            for snap in vm["snapshots"]["snapshot"]:
-                vm_obj.setdefault("snapshots", []).append({k: v for k, v in snap.items() if k in [
-                    "snapshot_status", "snapshot_type", "description", "date", "id"]})
+        VMs are processed one by one while they are received, from a single
+        streamed response, page by page or cluster by cluster. The engine
+        filters them by the search expression, so only monitored VMs are
+        transferred.
+        """
+        args = self._args
+        if args.partition_by_cluster:
+            return iter_vms_by_cluster(self._client, url, futures["/api/clusters"], executor,
+                                       args.max_workers, args.page_size, search, self._reduce_vm)
+        if args.page_size:
+            return itertools.chain.from_iterable(
+                self._client.iter_pages(url, "vm", args.page_size, executor, search))
+        return self._client.stream_objects(search_url(url, search), "vm", executor)
+    
+    def collect(self, stream=None):
+        """Collect all sections of the engine and return them as AgentOutput
         
-        snapshots_data.append(vm_obj)
+        With a stream the sections are written to it while they are collected.
+        """
+        args = self._args
+        client = self._client
+        deadline = Deadline(args.timeout)
+        performance = AgentPerformance()
+        status = AgentStatus(deadline)
+        client.start_run(performance, deadline)
         
-        # Create piggyback data for each VM
-        if generate_piggyback and "name" in vm_obj:
-            with SectionWriter(f"ovirt_snapshots", piggytarget=vm_obj["name"]) as w:
-                w.append_json(vm_obj)
+        # Fetch all endpoints concurrently, sections are still written in a fixed order
+        executor = ThreadPoolExecutor(max_workers=args.max_workers)
+        try:
+            # Snapshots change rarely, while they are cached only VM statistics are fetched
+            cache = EndpointCache(args.cache_dir, self._engine_url, args.max_stale, args.vm_search,
+                                  args.vm_statistics)
+            if self._cursor is not None:
+                # The changes since the last run decide which cached data is outdated
+                with status.within_deadline(EVENTS_ENDPOINT):
+                    try:
+                        self._cursor.fetch(client)
+                    except EndpointError as e:
+                        LOGGER.error("%s", e)
+                cache.invalidated = self._cursor.invalidated
+            
+            vm_snapshots = cached_snapshots = None
+            if self._cursor is not None and self._cursor.last_id is not None and args.cache_ttl["snapshots"] > 0:
+                # Snapshots are fetched again only for the VMs the events name
+                vm_snapshots = VmSnapshotCache(client, cache, executor, self._cursor.changed_vms, status)
+                with_snapshots = not vm_snapshots.loaded
+                # Snapshot changes are tracked per VM, the engine wide snapshots are not stored
+                self._cursor.invalidated.discard("snapshots")
+            else:
+                cached_snapshots = cache.get("snapshots", args.cache_ttl["snapshots"])
+                with_snapshots = cached_snapshots is None
+            vms_endpoint = VMS_ENDPOINT if with_snapshots else VMS_STATS_ENDPOINT
+            
+            futures = {}
+            cache_ttls = args.cache_ttl
+            if args.partition_by_cluster:
+                # The VMs are fetched per cluster, so the clusters are needed first. A
+                # cached cluster list would miss the VMs of new or renamed clusters
+                cache_ttls = {**cache_ttls, "clusters": 0}
+                futures = fetch_endpoints(client, API_ENDPOINTS, executor, cache, cache_ttls, status)
+            
+            if args.running_statistics_only:
+                # Statistics of VMs that are not running are meaningless, these
+                # VMs are listed by further requests without statistics. VMs in
+                # any other state, e.g. migrating, still get their statistics
+                light_endpoint = VMS_SNAPSHOTS_ENDPOINT if with_snapshots else VMS_LIST_ENDPOINT
+                running_search = _join_search(args.vm_search, *(f"status!={state}" for state in STOPPED_VM_STATES))
+                vms = iter_running_first(
+                    self._iter_vms(vms_endpoint, running_search, executor, futures),
+                    itertools.chain.from_iterable(
+                        self._iter_vms(light_endpoint, _join_search(args.vm_search, f"status={state}"), executor,
+                                       futures)
+                        for state in STOPPED_VM_STATES))
+            else:
+                vms = self._iter_vms(vms_endpoint, args.vm_search, executor, futures)
+            vms = _vms_with_fallback(vms, cache, status, self._reduce_vm)
+            
+            if not futures:
+                futures = fetch_endpoints(client, API_ENDPOINTS, executor, cache, cache_ttls, status)
+            output = AgentOutput(stream)
+            _write_sections(output, futures, vms, not args.no_piggyback, cache, cache_ttls,
+                            cached_snapshots, performance, status, args.vm_statistics, vm_snapshots)
+            
+            # Self-monitoring of the special agent, so slow endpoints can be spotted
+            performance_data = performance.section()
+            performance_data["cached"] = cache.served
+            output.add_json("ovirt_agent_performance", performance_data)
+            status_data = status.section()
+            self._breaker.end_run()
+            status_data["breaker"] = self._breaker.section()
+            if self._cursor is not None:
+                if vm_snapshots is None and "snapshots" in cache.refreshed:
+                    # The snapshots of all VMs were fetched, those of the changed VMs too.
+                    # The per-VM snapshots are not kept up to date without the events
+                    self._cursor.changed_vms.clear()
+                    cache.drop("vm_snapshots")
+                self._cursor.save(cache.refreshed)
+                status_data["events"] = self._cursor.section()
+            output.add_json("ovirt_agent_status", status_data)
+            return output
+        finally:
+            # Requests still queued would only fail on the exhausted time budget
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def collect_engine(args, engine_url, username, password, certfile=None, stream=None):
+    """Collect all sections of a single engine and return them as AgentOutput"""
+    collector = EngineCollector(args, engine_url, username, password, certfile)
+    try:
+        return collector.collect(stream)
+    finally:
+        collector.close()
+
+def _engine_collectors(args, password):
+    """Return the collectors of the engine of the monitored host and of the additional
+    engines, keyed by piggyback target"""
+    collectors = {None: EngineCollector(args, args.engine_url, args.username, password, args.certfile)}
+    for engine in args.engine:
+        host, engine_url, username, password_ref = engine[:4]
+        certfile = engine[4] if len(engine) > 4 else None
+        collectors[host] = EngineCollector(args, engine_url, username, _lookup_password(password_ref),
+                                           certfile, host)
+    return collectors
+
+def publish_output(path, output):
+    """Replace the published agent output atomically, so readers never see a partial output"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix(".tmp")
+    with tmp_file.open("w") as f:
+        output.write(f)
+    os.replace(tmp_file, path)
+
+def run_collector(args, password):
+    """Collect all engines every interval and publish the combined output until interrupted
+    
+    Every engine is polled in its own thread on its own schedule, so a slow
+    engine does not delay the others. After each run of an engine the
+    latest output of all engines is published again.
+    """
+    collectors = _engine_collectors(args, password)
+    outputs = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+    
+    def publish():
+        output = AgentOutput()
+        for target, engine_output in outputs.items():
+            output.add_output(engine_output, piggytarget=target)
+        try:
+            publish_output(args.output_file, output)
+        except OSError as e:
+            LOGGER.error("Cannot publish agent output to %s: %s", args.output_file, e)
+    
+    def poll(target, collector):
+        while not stop.is_set():
+            start = time.time()
+            try:
+                engine_output = collector.collect()
+            except Exception as e:
+                LOGGER.error("Error collecting %s: %s", target or args.engine_url, e)
+                engine_output = None
+            
+            with lock:
+                if engine_output is None:
+                    outputs.pop(target, None)
+                else:
+                    outputs[target] = engine_output
+                publish()
+            LOGGER.info("Collected %s in %.1fs", target or args.engine_url, time.time() - start)
+            stop.wait(max(args.interval - (time.time() - start), 0))
+    
+    threads = [threading.Thread(target=poll, args=item, daemon=True) for item in collectors.items()]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            stop.wait(1)
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        for collector in collectors.values():
+            collector.close()
+
+def read_published_output(path, max_age):
+    """Return the output published by the collector, None if it is missing or too old"""
+    try:
+        age = time.time() - path.stat().st_mtime
+        if age > max_age:
+            LOGGER.error("Output of the collector in %s is %ds old", path, age)
+            return None
+        return path.read_text()
+    except OSError as e:
+        LOGGER.error("Cannot read output of the collector: %s", e)
+        return None
+
+def collect_engines(args, password):
+    """Collect all engines concurrently, the sections of every additional engine
+    are redirected to its engine host"""
+    collectors = _engine_collectors(args, password)
+    
+    def collect(item):
+        target, collector = item
+        try:
+            return target, collector.collect()
+        except Exception as e:
+            # Failures of the engine of the monitored host fail the whole run
+            if args.debug or target is None:
+                raise
+            LOGGER.error("Error collecting %s: %s", target, e)
+            return target, None
+        finally:
+            collector.close()
     
-    # Write the main section with all snapshots
-    with SectionWriter(f"ovirt_snapshots_engine") as w:
-        w.append_json(snapshots_data)
+    output = AgentOutput()
+    with ThreadPoolExecutor(max_workers=len(collectors)) as executor:
+        for target, engine_output in executor.map(collect, collectors.items()):
+            if engine_output is not None:
+                output.add_output(engine_output, piggytarget=target)
+    return output
 
 def main(argv=None):
     """Main function to fetch data from oVirt API"""
     args = parse_arguments(argv or sys.argv[1:])
     
     try:
+        # Only print what the collector published, without contacting the engine
+        if args.from_collector:
+            published = read_published_output(args.output_file, 3 * args.interval)
+            if published is None:
+                return 1
+            sys.stdout.write(published)
+            return 0
+        
         # Get password from store or command line
         if args.password:
-            pw_id, pw_path = args.password.split(":")
-            password = password_store.lookup(Path(pw_path), pw_id)
+            password = _lookup_password(args.password)
         else:
             password = args.secret
         
-        # Create oVirt client
-        client = OvirtClient(
-            engine_url=args.engine_url,
-            username=args.username,
-            password=password,
-            certfile=args.certfile
-        )
-        
         # Version info to include in all sections
         version_info = {'PluginVersion': '1.0.6'}
         
-        # Fetch API data
-        api_data = client.get_data("/api")
-        
-        # Write overview section
-        overview_data = {}
-        for key in ["product_info", "summary"]:
-            if api_data and key in api_data:
-                overview_data.setdefault("api", {})[key] = api_data[key]
-        
-        # Fetch hosts data
-        hosts_data = client.get_data("/api/hosts?all_content=true")
-        
-        # Check for global maintenance
-        overview_data["global_maintenance"] = False
-        if hosts_data and "host" in hosts_data:
-            for host in hosts_data["host"]:
-                if ("hosted_engine" in host and host["hosted_engine"] and 
-                    "global_maintenance" in host["hosted_engine"] and 
-                    host["hosted_engine"]["global_maintenance"] == "true"):
-                    overview_data["global_maintenance"] = True
-                    break
-        
-        with SectionWriter("ovirt_overview") as w:
-            w.append_json(overview_data)
-        
-        # Process hosts data
-        process_hosts_data(hosts_data, not args.no_piggyback)
-        
-        # Fetch and process datacenters and storage domains
-        datacenters_data = client.get_data("/api/datacenters?follow=storage_domains")
-        
-        # Process datacenters data
-        data_center_result = {"datacenters": []}
-        storage_domain_result = {"storage_domains": []}
-        
-        if datacenters_data and "data_center" in datacenters_data:
-            for datacenter in datacenters_data["data_center"]:
-                if not datacenter:
-                    continue
-                
-                datacenter_obj = {}
-                for key in ["id", "version", "status", "description", "name", "supported_versions"]:
-                    if key in datacenter:
-                        datacenter_obj[key] = datacenter[key]
-                
-                data_center_result["datacenters"].append(datacenter_obj)
-                
-                for storage_domain in datacenter.get("storage_domains", {}).get("storage_domain", []):
-                    if not storage_domain:
-                        continue
-                    
-                    storage_domain_obj = {}
-                    storage_domain_obj.setdefault("data_center", {})["name"] = datacenter["name"]
-                    storage_domain_obj.setdefault("data_center", {})["id"] = datacenter["id"]
-                    
-                    for key in ["status", "name", "id", "external_status", "description", 
-                               "committed", "available", "used", "warning_low_space_indicator"]:
-                        if key in storage_domain:
-                            storage_domain_obj[key] = storage_domain[key]
-                    
-                    storage_domain_result["storage_domains"].append(storage_domain_obj)
-        
-        with SectionWriter("ovirt_datacenters") as w:
-            w.append_json(data_center_result)
-        
-        with SectionWriter("ovirt_storage_domains") as w:
-            w.append_json(storage_domain_result)
-        
-        # Fetch and process clusters
-        clusters_data = client.get_data("/api/clusters")
-        cluster_result = {"cluster": []}
-        
-        if clusters_data and "cluster" in clusters_data:
-            for cluster in clusters_data["cluster"]:
-                if not cluster:
-                    continue
-                
-                cluster_obj = {}
-                for key in ["id", "version", "description", "name"]:
-                    if key in cluster:
-                        cluster_obj[key] = cluster[key]
-                
-                cluster_obj.setdefault("data_center", {})["id"] = cluster.get(
-                    "data_center", {}).get("id", None)
-                
-                cluster_result["cluster"].append(cluster_obj)
-        
-        with SectionWriter("ovirt_clusters") as w:
-            w.append_json(cluster_result)
-        
-        # Fetch and process VM stats
-        vms_stats_data = client.get_data("/api/vms?follow=statistics")
-        process_vms_stats(vms_stats_data, not args.no_piggyback)
-        
-        # Fetch and process VM snapshots
-        vms_snapshots_data = client.get_data("/api/vms?follow=snapshots")
-        process_vms_snapshots(vms_snapshots_data, not args.no_piggyback)
+        if args.collector:
+            run_collector(args, password)
+            return 0
         
-        # Write compatibility information
-        compatibility_result = {}
-        if api_data and "product_info" in api_data:
-            compatibility_result["engine"] = api_data["product_info"]
-        
-        compatibility_result["datacenters"] = data_center_result.get("datacenters", [])
-        compatibility_result["cluster"] = cluster_result.get("cluster", [])
-        
-        with SectionWriter("ovirt_compatibility") as w:
-            w.append_json(compatibility_result)
+        # Additional engines are collected in this process alongside the engine
+        # of the monitored host, saving a process per engine. Their outputs are
+        # merged, a single engine is written while it is collected
+        if args.engine:
+            output = collect_engines(args, password)
+        else:
+            output = collect_engine(args, args.engine_url, args.username, password, args.certfile,
+                                    sys.stdout)
+        output.write(sys.stdout)
         
         return 0
     
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# /local/lib/python3/cmk_addons/plugins/ovirt/tools/bench_output.py
+"""Benchmark the buffered output stage of the oVirt special agent
+
+Compares writing every section on its own, flushed like a SectionWriter
+context does, with the buffered and the streaming AgentOutput. Run it in
+the site context:
+
+    python3 -m cmk_addons.plugins.ovirt.tools.bench_output --vms 5000
+"""
+
+# License: GNU General Public License v2
+
+import argparse
+import collections
+import io
+import json
+import os
+import sys
+import time
+
+from cmk_addons.plugins.ovirt.special_agents.agent_ovirt import AgentOutput, process_vms
+from cmk_addons.plugins.ovirt.tools.synthetic_inventory import SyntheticInventory
+
+class _CountingFile(io.FileIO):
+    """Raw file that counts the write calls reaching the operating system"""
+    
+    def __init__(self, path):
+        super().__init__(path, "w")
+        self.writes = 0
+    
+    def write(self, b):
+        self.writes += 1
+        return super().write(b)
+
+class _PerSectionOutput:
+    """Writes every section immediately and flushes it, like a SectionWriter context"""
+    
+    def __init__(self, stream):
+        self._stream = stream
+    
+    def add_json(self, name, data, piggytarget=None):
+        if piggytarget is not None:
+            self._stream.write(f"<<<<{piggytarget}>>>>\n")
+        self._stream.write(f"<<<{name}:sep(0)>>>\n")
+        self._stream.write(json.dumps(data, sort_keys=True) + "\n")
+        if piggytarget is not None:
+            self._stream.write("<<<<>>>>\n")
+        self._stream.flush()
+    
+    def write(self, stream):
+        stream.flush()
+
+def _sections_by_target(text):
+    """Return the sections of an agent output per piggyback target, ignoring their order"""
+    sections = collections.Counter()
+    target = header = None
+    for line in text.splitlines():
+        if line.startswith("<<<<") and line.endswith(">>>>"):
+            target = line[4:-4] or None
+        elif line.startswith("<<<"):
+            header = line
+        else:
+            sections[(target, header, line)] += 1
+    return sections
+
+def run(output_factory, vms, path):
+    """Process the VMs into path, return (seconds, write syscalls)"""
+    raw = _CountingFile(path)
+    stream = io.TextIOWrapper(raw, encoding="utf-8")
+    try:
+        start = time.perf_counter()
+        output = output_factory(stream)
+        process_vms(output, vms)
+        output.write(stream)
+        return time.perf_counter() - start, raw.writes
+    finally:
+        stream.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vms", type=int, default=5000, help="Number of VMs (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic VMs (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per variant, the best is reported")
+    parser.add_argument("--output", default=os.devnull,
+                        help="File the agent output is written to (default: %(default)s)")
+    args = parser.parse_args(argv)
+    
+    inventory = SyntheticInventory(seed=args.seed, vms=args.vms)
+    vms = [inventory.vm(index, ("statistics", "snapshots")) for index in range(args.vms)]
+    variants = {
+        "per section": _PerSectionOutput,
+        "buffered": lambda stream: AgentOutput(),
+        "streaming": AgentOutput,
+    }
+    
+    print(f"{args.vms} VMs, best of {args.repeat} runs")
+    results = {}
+    for name, factory in variants.items():
+        results[name] = min(run(factory, vms, args.output) for _ in range(args.repeat))
+        seconds, writes = results[name]
+        print(f"{name:>12}: {seconds * 1000:8.1f} ms {writes:8d} write syscalls")
+    
+    # Both variants have to produce the same sections for every piggyback target
+    rendered = {}
+    for name, factory in variants.items():
+        buffer = io.StringIO()
+        output = factory(buffer)
+        process_vms(output, vms)
+        output.write(buffer)
+        rendered[name] = _sections_by_target(buffer.getvalue())
+    identical = len({frozenset(sections.items()) for sections in rendered.values()}) == 1
+    print(f"identical sections: {'yes' if identical else 'NO'}")
+    return 0 if identical else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# /local/lib/python3/cmk_addons/plugins/ovirt/tools/benchmark.py
+"""End to end benchmark of the oVirt special agent
+
+Runs agent_ovirt.main() against the mock engine at several inventory sizes,
+or against responses saved with --record, and reports the wall time per
+stage, the peak RSS, the output size and the number of HTTP requests.
+Every run is a fresh process with an empty cache directory. The results
+are stored as JSON, so releases can be compared:
+
+    python3 -m cmk_addons.plugins.ovirt.tools.benchmark --sizes 100,1000,10000 --output new.json
+    python3 -m cmk_addons.plugins.ovirt.tools.benchmark --replay /tmp/capture --compare new.json
+"""
+
+# License: GNU General Public License v2
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.request import urlopen
+
+from cmk_addons.plugins.ovirt.tools.mock_engine import PREFIX, MockEngine
+from cmk_addons.plugins.ovirt.tools.synthetic_inventory import SyntheticInventory
+
+# Sections of the agent output kept for the report
+REPORTED_SECTIONS = ("ovirt_agent_performance", "ovirt_agent_status")
+
+class _OutputSink:
+    """Replaces stdout of the agent, counts the output and keeps the self-monitoring sections"""
+    
+    def __init__(self):
+        self.bytes = 0
+        self.sections = {}
+        self._pending = ""
+        self._header = None
+    
+    def write(self, text):
+        self.bytes += len(text.encode("utf-8"))
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            if self._header is not None:
+                self.sections[self._header] = json.loads(line)
+                self._header = None
+            elif line.startswith("<<<") and not line.startswith("<<<<"):
+                name = line[3:].split(":", 1)[0].rstrip(">")
+                self._header = name if name in REPORTED_SECTIONS else None
+        return len(text)
+    
+    def flush(self):
+        pass
+
+def _peak_rss_kb():
+    """Return the peak RSS of this process in kilobytes
+    
+    ru_maxrss is only the fallback, on Linux it keeps the peak of the parent
+    process from before the fork, including the mock engine.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _run_agent(argv, results):
+    """Run the special agent in this process and put its measurements into results"""
+    from cmk_addons.plugins.ovirt.special_agents.agent_ovirt import main
+    
+    sink = _OutputSink()
+    sys.stdout = sink
+    start = time.perf_counter()
+    exit_code = main(argv)
+    wall_time = time.perf_counter() - start
+    sys.stdout = sys.__stdout__
+    
+    performance = sink.sections.get("ovirt_agent_performance", {})
+    results.put({
+        "exit_code": exit_code,
+        "wall_time": round(wall_time, 3),
+        "stages": {stage["name"]: stage["seconds"] for stage in performance.get("stages", [])},
+        "peak_rss_kb": _peak_rss_kb(),
+        "output_bytes": sink.bytes,
+        "http_requests": len(performance.get("requests", [])),
+        "skipped": sink.sections.get("ovirt_agent_status", {}).get("skipped", []),
+    })
+
+def run_agent(argv):
+    """Run the special agent in a fresh process, so peak RSS and imports are measured per run"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_agent, args=(argv, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def _engine_requests(url, reset=False):
+    """Return the number of requests the mock engine received"""
+    with urlopen(f"{url}/__stats" + ("?reset=1" if reset else "")) as r:
+        return json.load(r)["total"]
+
+def benchmark(label, engine_url, agent_args, repeat, mock_url=None, warmup=1):
+    """Run the agent repeat times, every time with an empty cache directory
+    
+    The warmup runs are not reported, they let the mock engine render its
+    responses once.
+    """
+    runs = []
+    for number in range(warmup + repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            argv = ["--engine-url", engine_url, "-s", "benchmark", "--cache-dir", cache_dir, *agent_args]
+            if mock_url is not None:
+                _engine_requests(mock_url, reset=True)
+            result = run_agent(argv)
+            if mock_url is not None:
+                result["engine_requests"] = _engine_requests(mock_url)
+        if number < warmup:
+            continue
+        result["label"] = label
+        runs.append(result)
+        print(f"{label:>12}: {result['wall_time']:8.3f} s {result['peak_rss_kb'] / 1024:8.1f} MB "
+              f"{result['output_bytes'] / 1024:10.1f} kB {result['http_requests']:5d} requests",
+              file=sys.stderr)
+    return runs
+
+def summarize(runs):
+    """Return the medians of all runs per label"""
+    summary = {}
+    for label in dict.fromkeys(run["label"] for run in runs):
+        selected = [run for run in runs if run["label"] == label]
+        stages = {name for run in selected for name in run["stages"]}
+        summary[label] = {
+            "wall_time": statistics.median(run["wall_time"] for run in selected),
+            "peak_rss_kb": statistics.median(run["peak_rss_kb"] for run in selected),
+            "output_bytes": statistics.median(run["output_bytes"] for run in selected),
+            "http_requests": statistics.median(run["http_requests"] for run in selected),
+            "stages": {name: statistics.median(run["stages"].get(name, 0.0) for run in selected)
+                       for name in sorted(stages)},
+        }
+    return summary
+
+def compare(summary, baseline):
+    """Print the change of every median against a previous result file"""
+    print("change against baseline:")
+    for label, values in summary.items():
+        if label not in baseline:
+            continue
+        changes = []
+        for key in ("wall_time", "peak_rss_kb", "output_bytes", "http_requests"):
+            old = baseline[label].get(key)
+            if old:
+                changes.append(f"{key} {(values[key] - old) / old:+.1%}")
+        print(f"{label:>12}: {', '.join(changes)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000",
+                        help="Comma separated numbers of VMs of the mock engine (default: %(default)s)")
+    parser.add_argument("--replay", type=Path, action="append", default=[], metavar="DIR",
+                        help="Benchmark responses saved with --record instead of the mock engine, "
+                             "can be given multiple times")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="Unreported runs per size before the measured ones (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Response delay of the mock engine in seconds (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the synthetic inventory (default: %(default)s)")
+    parser.add_argument("--agent-args", default="",
+                        help="Additional arguments of the special agent, e.g. \"--page-size 500\"")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="Compare with the results in this JSON file")
+    args = parser.parse_args(argv)
+    
+    agent_args = args.agent_args.split()
+    runs = []
+    if args.replay:
+        for capture_dir in args.replay:
+            runs += benchmark(capture_dir.name, "http://replay" + PREFIX,
+                              ["--replay", str(capture_dir), *agent_args], args.repeat, warmup=args.warmup)
+    else:
+        for size in (int(size) for size in args.sizes.split(",")):
+            hosts = max(size // 50, 1)
+            inventory = SyntheticInventory(seed=args.seed, vms=size, hosts=hosts, clusters=max(hosts // 10, 1))
+            server = MockEngine(("127.0.0.1", 0), inventory, latency=args.latency)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            mock_url = f"http://127.0.0.1:{server.server_address[1]}{PREFIX}"
+            try:
+                runs += benchmark(f"{size} VMs", mock_url, ["--basic-auth", *agent_args], args.repeat,
+                                  mock_url, args.warmup)
+            finally:
+                server.shutdown()
+                server.server_close()
+    
+    summary = summarize(runs)
+    results = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "agent_args": agent_args,
+        "summary": summary,
+        "runs": runs,
+    }
+    print(json.dumps(summary, indent=2))
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.compare is not None:
+        compare(summary, json.loads(args.compare.read_text())["summary"])
+    return 0 if all(run["exit_code"] == 0 for run in runs) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
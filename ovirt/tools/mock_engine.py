@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# /local/lib/python3/cmk_addons/plugins/ovirt/tools/mock_engine.py
+"""Mock oVirt Engine for load and scale tests of the oVirt special agent
+
+Serves the API endpoints the special agent uses with a synthetic inventory
+of configurable size, see synthetic_inventory, with configurable latency,
+error injection and the search paging of the API. Only the standard library
+is needed, e.g.:
+
+    python3 -m cmk_addons.plugins.ovirt.tools.mock_engine --vms 10000 --latency 0.2
+
+    agent_ovirt --engine-url http://127.0.0.1:8443/ovirt-engine -s secret
+
+The number of requests per endpoint is available at /__stats and reset
+with /__stats?reset=1. Events are added to /api/events with
+/__event?code=68&vm=12, referring to VM or host indexes of the inventory.
+"""
+
+# License: GNU General Public License v2
+
+import argparse
+import collections
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from cmk_addons.plugins.ovirt.tools.synthetic_inventory import add_arguments, inventory_from_arguments
+
+PREFIX = "/ovirt-engine"
+
+def _search_terms(query):
+    """Return the name=value and name!=value terms of the search expression of a request,
+    all of them have to match
+    
+    The values of negated terms are prefixed with "!".
+    """
+    return [(name, ("!" if negated else "") + value)
+            for name, negated, value in re.findall(r"(\w+)(!?)=(\S+)", query.get("search", [""])[0])]
+
+def _matches(value, term):
+    """Return whether a value matches a search term, which may be negated"""
+    if term.startswith("!"):
+        return value != term[1:]
+    return value == term
+
+def _page(objects, query):
+    """Apply the max parameter and the "page N" search of the API to a list of objects"""
+    if "max" not in query:
+        return objects
+    size = int(query["max"][0])
+    match = re.search(r"\bpage (\d+)", query.get("search", [""])[0])
+    page = int(match.group(1)) if match else 1
+    return objects[(page - 1) * size:page * size]
+
+class MockEngine(ThreadingHTTPServer):
+    """HTTP server answering like an oVirt Engine"""
+    
+    daemon_threads = True
+    
+    def __init__(self, address, inventory, latency=0.0, jitter=0.0, error_rate=0.0, fail=(), paging=True):
+        super().__init__(address, _Handler)
+        self.inventory = inventory
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail = tuple(fail)
+        self.paging = paging
+        self.requests = collections.Counter()
+        self._lock = threading.Lock()
+        # Rendered responses by path, the inventory does not change
+        self._responses = {}
+        # Events added with add_event, oldest first
+        self.events = []
+        # Inventory indexes by VM id, created on the first request of a single VM
+        self._vm_indexes = None
+    
+    def count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+    
+    def stats(self, reset=False):
+        with self._lock:
+            stats = {"total": sum(self.requests.values()), "endpoints": dict(self.requests)}
+            if reset:
+                self.requests.clear()
+            return stats
+    
+    def add_event(self, code, description="", vm=None, host=None):
+        """Add an event referring to the VM or host with the given inventory index"""
+        inventory = self.inventory
+        event = {"code": code, "description": description, "severity": "normal",
+                 "time": int(time.time() * 1000)}
+        if vm is not None:
+            event["vm"] = {"id": inventory.vm_id(vm)}
+            event["cluster"] = {"id": inventory.cluster_id(inventory.vm_cluster(vm))}
+        if host is not None:
+            event["host"] = {"id": inventory.host_id(host)}
+        with self._lock:
+            event["id"] = str(len(self.events) + 1)
+            self.events.append(event)
+        return event
+    
+    def events_response(self, query):
+        """Return the status and body of /api/events, newest event first like the engine"""
+        with self._lock:
+            events = list(self.events)
+        if "from" in query:
+            events = [event for event in events if int(event["id"]) > int(query["from"][0])]
+        events.reverse()
+        if "max" in query:
+            events = events[:int(query["max"][0])]
+        return 200, json.dumps({"event": events} if events else {}).encode("utf-8")
+    
+    def response(self, path, query):
+        """Return the status and the rendered body of an API request"""
+        key = (path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        if key not in self._responses:
+            self._responses[key] = self._render(path, query)
+        return self._responses[key]
+    
+    def _render(self, path, query):
+        inventory = self.inventory
+        follow = query.get("follow", [""])[0].split(",")
+        paged = _page if self.paging else lambda objects, query: objects
+        
+        if path == "/api":
+            data = inventory.api()
+        elif path == "/api/hosts":
+            data = {"host": paged([inventory.host(i) for i in range(inventory.hosts)], query)}
+        elif path == "/api/clusters":
+            data = {"cluster": paged([inventory.cluster(i) for i in range(inventory.clusters)], query)}
+        elif path == "/api/datacenters":
+            data = {"data_center": paged(
+                [inventory.datacenter(i, follow) for i in range(inventory.datacenters)], query)}
+        elif path == "/api/vms":
+            # Only the VMs of the requested page are generated, the search
+            # supports the status and cluster terms
+            indexes = range(inventory.vms)
+            for name, term in _search_terms(query):
+                if name == "status":
+                    indexes = [i for i in indexes if _matches(inventory.vm_status(i), term)]
+                elif name == "cluster":
+                    indexes = [i for i in indexes
+                               if _matches(inventory.cluster(inventory.vm_cluster(i))["name"], term)]
+            indexes = paged(indexes, query)
+            data = {"vm": [inventory.vm(i, follow) for i in indexes]}
+        elif re.fullmatch(r"/api/vms/[^/]+/snapshots", path):
+            if self._vm_indexes is None:
+                self._vm_indexes = {inventory.vm_id(i): i for i in range(inventory.vms)}
+            index = self._vm_indexes.get(path.split("/")[3])
+            if index is None:
+                return 404, json.dumps({"detail": "Not found", "reason": "Not Found"}).encode("utf-8")
+            data = {"snapshot": inventory.vm_snapshots(index)}
+        else:
+            return 404, json.dumps({"detail": "Not found", "reason": "Not Found"}).encode("utf-8")
+        
+        # Like the engine, empty collections are sent as an empty object
+        if len(data) == 1 and not next(iter(data.values())):
+            data = {}
+        return 200, json.dumps(data).encode("utf-8")
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _delay(self):
+        server = self.server
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlsplit(self.path).path.removeprefix(PREFIX)
+        if path != "/sso/oauth/token":
+            return self._send(404, b"{}")
+        self.server.count("sso")
+        self._delay()
+        self._send(200, json.dumps(
+            {"access_token": "mock-token", "token_type": "bearer", "expires_in": 3600}).encode("utf-8"))
+    
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        path = url.path.removeprefix(PREFIX).rstrip("/")
+        query = parse_qs(url.query)
+        
+        if path == "/__stats":
+            return self._send(200, json.dumps(server.stats("reset" in query)).encode("utf-8"))
+        if path == "/__event":
+            event = server.add_event(
+                int(query.get("code", ["0"])[0]),
+                query.get("description", [""])[0],
+                int(query["vm"][0]) if "vm" in query else None,
+                int(query["host"][0]) if "host" in query else None,
+            )
+            return self._send(200, json.dumps(event).encode("utf-8"))
+        
+        name = path.split("/")[2] if path.count("/") > 1 else "api"
+        server.count(name)
+        self._delay()
+        
+        if any(pattern in self.path for pattern in server.fail) or random.random() < server.error_rate:
+            return self._send(503, json.dumps({"detail": "Injected error"}).encode("utf-8"))
+        if path == "/api/events":
+            return self._send(*server.events_response(query))
+        self._send(*server.response(path, query))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default="127.0.0.1", help="Listen address (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8443, help="Listen port (default: %(default)s)")
+    add_arguments(parser)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Delay of every response in seconds (default: %(default)s)")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Random additional delay of up to this many seconds (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with 503 (default: %(default)s)")
+    parser.add_argument("--fail", action="append", default=[], metavar="PATTERN",
+                        help="Answer requests whose path contains PATTERN with 503, e.g. /api/vms")
+    parser.add_argument("--no-paging", action="store_true",
+                        help="Ignore max and the page search, always send whole collections")
+    args = parser.parse_args(argv)
+    
+    inventory = inventory_from_arguments(args)
+    server = MockEngine((args.address, args.port), inventory, args.latency, args.jitter, args.error_rate,
+                        args.fail, not args.no_paging)
+    print(f"Mock oVirt Engine with {args.vms} VMs on http://{args.address}:{args.port}{PREFIX}",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# /local/lib/python3/cmk_addons/plugins/ovirt/tools/synthetic_inventory.py
+"""Synthetic oVirt inventories with the shapes of the oVirt Engine API
+
+Generates hosts, VMs with statistics and snapshots, datacenters with
+storage domains and clusters, nested like the JSON documents of the API,
+e.g. statistics.statistic[].values.value[0] or storage_domains.storage_domain.
+Every object is derived from the seed and its index only, so a page of a
+collection is the same whether it is generated alone or with the whole
+collection. Only the standard library is needed. Write the documents of an
+inventory to a directory with:
+
+    python3 -m cmk_addons.plugins.ovirt.tools.synthetic_inventory --vms 10000 --out /tmp/inventory
+"""
+
+# License: GNU General Public License v2
+
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+API_PREFIX = "/ovirt-engine/api"
+
+# Statistics of a VM as sent by oVirt 4.5: name -> (unit, type, description)
+VM_STATISTICS = {
+    "memory.installed": ("bytes", "integer", "Total memory configured"),
+    "memory.used": ("bytes", "integer", "Memory used (agent)"),
+    "memory.free": ("bytes", "integer", "Memory free (agent)"),
+    "memory.buffered": ("bytes", "integer", "Memory buffered (agent)"),
+    "memory.cached": ("bytes", "integer", "Memory cached (agent)"),
+    "memory.unused": ("bytes", "integer", "Memory unused (agent)"),
+    "cpu.current.guest": ("percent", "decimal", "CPU used by guest"),
+    "cpu.current.hypervisor": ("percent", "decimal", "CPU overhead"),
+    "cpu.current.total": ("percent", "decimal", "Total CPU used"),
+    "migration.progress": ("percent", "decimal", "Migration Progress"),
+    "network.current.total": ("percent", "decimal", "Total network used"),
+    "elapsed.time": ("seconds", "integer", "Elapsed VM runtime"),
+    "cpu.usage.history": ("percent", "integer", "List of CPU usage history, sorted by date from newest to oldest, at intervals of 30 seconds"),
+    "memory.usage.history": ("percent", "integer", "List of memory usage history, sorted by date from newest to oldest, at intervals of 30 seconds"),
+    "network.usage.history": ("percent", "integer", "List of network usage history, sorted by date from newest to oldest, at intervals of 30 seconds"),
+    "disks.usage": ("none", "string", "Disk usage, in bytes, per filesystem as JSON (agent)"),
+}
+
+GiB = 1024 ** 3
+
+def _ref(kind, object_id):
+    """Return a reference to another object, like the API links related objects"""
+    return {"href": f"{API_PREFIX}/{kind}/{object_id}", "id": object_id}
+
+def _version(major, minor, build=0, revision=0, full_version=None):
+    version = {"build": build, "major": major, "minor": minor, "revision": revision}
+    if full_version is not None:
+        version["full_version"] = full_version
+    return version
+
+class SyntheticInventory:
+    """Inventory of an engine, generated reproducibly from a seed
+    
+    vms, hosts, clusters, datacenters and storage_domains are the numbers of
+    objects. Every VM has 1 + a geometrically distributed number of
+    snapshots with mean snapshots, vms_up is the fraction of running VMs.
+    statistics limits the VM statistics to the given names, history is the
+    number of values of the *.usage.history statistics.
+    """
+    
+    def __init__(self, seed=0, vms=1000, hosts=20, clusters=2, datacenters=1, storage_domains=4,
+                 snapshots=1.0, vms_up=0.9, statistics=None, history=40):
+        self.seed = seed
+        self.vms = vms
+        self.hosts = hosts
+        self.clusters = max(clusters, 1)
+        self.datacenters = max(datacenters, 1)
+        self.storage_domains = storage_domains
+        self.snapshots = snapshots
+        self.vms_up = vms_up
+        self.statistics = list(statistics) if statistics is not None else list(VM_STATISTICS)
+        self.history = history
+    
+    def _random(self, kind, index):
+        """Return the random generator of a single object"""
+        return random.Random(f"{self.seed}:{kind}:{index}")
+    
+    @staticmethod
+    def _id(kind, index):
+        return f"{kind:08x}-{index >> 48 & 0xffff:04x}-4000-8000-{index & 0xffffffffffff:012x}"
+    
+    def host_id(self, index):
+        return self._id(1, index)
+    
+    def cluster_id(self, index):
+        return self._id(2, index)
+    
+    def datacenter_id(self, index):
+        return self._id(3, index)
+    
+    def storage_domain_id(self, index):
+        return self._id(4, index)
+    
+    def vm_id(self, index):
+        return self._id(5, index)
+    
+    def vm_cluster(self, index):
+        return index % self.clusters
+    
+    def vm_status(self, index):
+        return "up" if self._random("vm", index).random() < self.vms_up else "down"
+    
+    def api(self):
+        """Return the document of /api"""
+        vms_up = sum(self.vm_status(index) == "up" for index in range(self.vms))
+        return {
+            "product_info": {
+                "instance_id": self._id(0, self.seed),
+                "name": "oVirt Engine",
+                "vendor": "ovirt.org",
+                "version": _version(4, 5, 6, 0, "4.5.6-1.el9"),
+            },
+            "summary": {
+                "hosts": {"active": str(self.hosts), "total": str(self.hosts)},
+                "storage_domains": {"active": str(self.storage_domains), "total": str(self.storage_domains)},
+                "users": {"active": "3", "total": "12"},
+                "vms": {"active": str(vms_up), "total": str(self.vms)},
+            },
+            "time": 1700000000000,
+            "authenticated_user": _ref("users", self._id(9, 0)),
+            "effective_user": _ref("users", self._id(9, 0)),
+        }
+    
+    def host(self, index):
+        """Return a host as sent by /api/hosts?all_content=true"""
+        rng = self._random("host", index)
+        host_id = self.host_id(index)
+        vms = self.vms // max(self.hosts, 1)
+        return {
+            "address": f"host{index:03d}.example.com",
+            "auto_numa_status": "disable",
+            "certificate": {"organization": "example.com", "subject": f"O=example.com,CN=host{index:03d}.example.com"},
+            "cpu": {
+                "name": "Intel(R) Xeon(R) Gold 6248R CPU @ 3.00GHz",
+                "speed": 3000,
+                "topology": {"cores": 24, "sockets": 2, "threads": 2},
+                "type": "Intel Cascadelake Server Family",
+            },
+            "external_status": "ok",
+            "hosted_engine": {
+                "active": str(index == 0).lower(),
+                "configured": str(index < 3).lower(),
+                "global_maintenance": "false",
+                "local_maintenance": "false",
+                "score": 3400,
+            },
+            "kdump_status": "disabled",
+            "ksm": {"enabled": "false"},
+            "libvirt_version": _version(8, 0, 0, 0, "libvirt-8.0.0-23.el9"),
+            "max_scheduling_memory": (512 - rng.randint(16, 400)) * GiB,
+            "memory": 512 * GiB,
+            "os": {"type": "RHEL", "version": {"full_version": "9 - 3.el9", "major": 9}},
+            "port": 54321,
+            "protocol": "stomp",
+            "se_linux": {"mode": "enforcing"},
+            "spm": {"priority": 5, "status": "spm" if index == 0 else "none"},
+            "status": "maintenance" if rng.random() < 0.02 else "up",
+            "summary": {"active": str(vms), "migrating": "0", "total": str(vms)},
+            "type": "rhel",
+            "update_available": "false",
+            "version": _version(4, 50, 5, 1, "vdsm-4.50.5.1-1.el9"),
+            "vgpu_placement": "consolidated",
+            "cluster": _ref("clusters", self.cluster_id(index % self.clusters)),
+            "name": f"host{index:03d}",
+            "href": f"{API_PREFIX}/hosts/{host_id}",
+            "id": host_id,
+        }
+    
+    def cluster(self, index):
+        """Return a cluster as sent by /api/clusters"""
+        cluster_id = self.cluster_id(index)
+        return {
+            "ballooning_enabled": "true",
+            "cpu": {"architecture": "x86_64", "type": "Intel Cascadelake Server Family"},
+            "description": f"Cluster {index}",
+            "firewall_type": "firewalld",
+            "ha_reservation": "false",
+            "memory_policy": {"over_commit": {"percent": 100}, "transparent_hugepages": {"enabled": "true"}},
+            "switch_type": "legacy",
+            "threads_as_cores": "false",
+            "version": {"major": 4, "minor": 7},
+            "data_center": _ref("datacenters", self.datacenter_id(index % self.datacenters)),
+            "mac_pool": _ref("macpools", self._id(8, 0)),
+            "scheduling_policy": _ref("schedulingpolicies", self._id(7, 0)),
+            "name": f"cluster{index:02d}",
+            "href": f"{API_PREFIX}/clusters/{cluster_id}",
+            "id": cluster_id,
+        }
+    
+    def storage_domain(self, index):
+        """Return a storage domain as sent with follow=storage_domains"""
+        rng = self._random("storage_domain", index)
+        size = rng.choice([2, 4, 8, 16]) * 1024 * GiB
+        used = int(size * rng.uniform(0.2, 0.9))
+        storage_domain_id = self.storage_domain_id(index)
+        return {
+            "available": str(size - used),
+            "backup": "false",
+            "block_size": 512,
+            "committed": str(int(used * rng.uniform(1.0, 1.8))),
+            "critical_space_action_blocker": 5,
+            "description": "",
+            "discard_after_delete": "false",
+            "external_status": "ok",
+            "master": str(index < self.datacenters).lower(),
+            "status": "active",
+            "storage": {"address": "nfs.example.com", "path": f"/export/data{index:02d}", "type": "nfs"},
+            "storage_format": "v5",
+            "supports_discard": "false",
+            "type": "data",
+            "used": str(used),
+            "warning_low_space_indicator": 10,
+            "wipe_after_delete": "false",
+            "name": f"data{index:02d}",
+            "href": f"{API_PREFIX}/storagedomains/{storage_domain_id}",
+            "id": storage_domain_id,
+        }
+    
+    def datacenter(self, index, follow=()):
+        """Return a datacenter as sent by /api/datacenters, with follow=storage_domains
+        including its storage domains"""
+        datacenter_id = self.datacenter_id(index)
+        datacenter = {
+            "description": "The default Data Center" if index == 0 else "",
+            "local": "false",
+            "quota_mode": "disabled",
+            "status": "up",
+            "storage_format": "v5",
+            "supported_versions": {"version": [{"major": 4, "minor": 7}]},
+            "version": {"major": 4, "minor": 7},
+            "mac_pool": _ref("macpools", self._id(8, 0)),
+            "name": "Default" if index == 0 else f"datacenter{index:02d}",
+            "href": f"{API_PREFIX}/datacenters/{datacenter_id}",
+            "id": datacenter_id,
+        }
+        if "storage_domains" in follow:
+            datacenter["storage_domains"] = {"storage_domain": [
+                self.storage_domain(storage_domain) for storage_domain in range(self.storage_domains)
+                if storage_domain % self.datacenters == index
+            ]}
+        return datacenter
+    
+    def vm_statistics(self, index):
+        """Return the statistics of a VM as sent with follow=statistics"""
+        rng = self._random("vm_statistics", index)
+        vm_id = self.vm_id(index)
+        running = self.vm_status(index) == "up"
+        memory = rng.choice([2, 4, 8, 16, 32]) * GiB
+        used = int(memory * rng.uniform(0.1, 0.95)) if running else 0
+        values = {
+            "memory.installed": memory,
+            "memory.used": used,
+            "memory.free": memory - used,
+            "memory.buffered": used // 20,
+            "memory.cached": used // 5,
+            "memory.unused": (memory - used) // 2,
+            "cpu.current.guest": round(rng.uniform(0, 80), 2) if running else 0,
+            "cpu.current.hypervisor": round(rng.uniform(0, 5), 2) if running else 0,
+            "migration.progress": 0,
+            "network.current.total": round(rng.uniform(0, 10), 2) if running else 0,
+            "elapsed.time": rng.randint(60, 90 * 86400) if running else 0,
+        }
+        values["cpu.current.total"] = round(values["cpu.current.guest"] + values["cpu.current.hypervisor"], 2)
+        
+        statistics = []
+        for number, name in enumerate(self.statistics):
+            unit, value_type, description = VM_STATISTICS[name]
+            if name.endswith(".history"):
+                value = [{"datum": rng.randint(0, 100)} for _ in range(self.history)] if running else []
+            elif name == "disks.usage":
+                value = [{"detail": json.dumps([{"fs": "xfs", "path": "/", "total": str(40 * GiB),
+                                                 "used": str(rng.randint(2, 39) * GiB)}])}] if running else []
+            else:
+                value = [{"datum": values[name]}]
+            statistic_id = self._id(6, number)
+            statistics.append({
+                "kind": "gauge",
+                "type": value_type,
+                "unit": unit,
+                "values": {"value": value},
+                "vm": _ref("vms", vm_id),
+                "name": name,
+                "description": description,
+                "href": f"{API_PREFIX}/vms/{vm_id}/statistics/{statistic_id}",
+                "id": statistic_id,
+            })
+        return statistics
+    
+    def vm_snapshots(self, index):
+        """Return the snapshots of a VM as sent with follow=snapshots or by /api/vms/{id}/snapshots"""
+        rng = self._random("vm_snapshots", index)
+        vm_id = self.vm_id(index)
+        count = 1
+        # Geometric distribution with the configured mean of additional snapshots
+        while self.snapshots > 0 and rng.random() < self.snapshots / (1 + self.snapshots):
+            count += 1
+        snapshots = []
+        for snapshot in range(count):
+            snapshot_id = f"{index & 0xffffffff:08x}-{snapshot:04x}-4000-8000-{self.seed & 0xffffffffffff:012x}"
+            active = snapshot == count - 1
+            snapshots.append({
+                "date": 1700000000000 + snapshot * 86400000 + rng.randint(0, 86400000),
+                "description": "Active VM" if active else f"backup-{snapshot:03d}",
+                "persist_memorystate": "false",
+                "snapshot_status": "locked" if not active and rng.random() < 0.01 else "ok",
+                "snapshot_type": "active" if active else "regular",
+                "vm": _ref("vms", vm_id),
+                "href": f"{API_PREFIX}/vms/{vm_id}/snapshots/{snapshot_id}",
+                "id": snapshot_id,
+            })
+        return snapshots
+    
+    def vm(self, index, follow=()):
+        """Return a VM as sent by /api/vms, including the follows statistics and snapshots if requested"""
+        rng = self._random("vm_attributes", index)
+        vm_id = self.vm_id(index)
+        vm = {
+            "bios": {"boot_menu": {"enabled": "false"}, "type": "q35_ovmf"},
+            "cpu": {"architecture": "x86_64", "topology": {"cores": 1, "sockets": rng.choice([1, 2, 4, 8]),
+                                                          "threads": 1}},
+            "creation_time": 1600000000000 + index * 1000,
+            "delete_protected": "false",
+            "high_availability": {"enabled": "false", "priority": 0},
+            "memory": rng.choice([2, 4, 8, 16, 32]) * GiB,
+            "origin": "ovirt",
+            "os": {"type": rng.choice(["rhel_9x64", "rhel_8x64", "windows_2019x64", "other_linux"])},
+            "stateless": "false",
+            "status": self.vm_status(index),
+            "type": "server",
+            "cluster": _ref("clusters", self.cluster_id(self.vm_cluster(index))),
+            "name": f"vm{index:05d}",
+            "href": f"{API_PREFIX}/vms/{vm_id}",
+            "id": vm_id,
+        }
+        if vm["status"] == "up":
+            vm["host"] = _ref("hosts", self.host_id(index % max(self.hosts, 1)))
+        if "statistics" in follow:
+            vm["statistics"] = {"statistic": self.vm_statistics(index)}
+        if "snapshots" in follow:
+            vm["snapshots"] = {"snapshot": self.vm_snapshots(index)}
+        return vm
+    
+    def documents(self):
+        """Return the documents of the endpoints the special agent uses, by name"""
+        follow = ("statistics", "snapshots")
+        return {
+            "api": self.api(),
+            "hosts": {"host": [self.host(index) for index in range(self.hosts)]},
+            "datacenters": {"data_center": [self.datacenter(index, ("storage_domains",))
+                                            for index in range(self.datacenters)]},
+            "clusters": {"cluster": [self.cluster(index) for index in range(self.clusters)]},
+            "vms": {"vm": [self.vm(index, follow) for index in range(self.vms)]},
+        }
+
+def add_arguments(parser):
+    """Add the options describing an inventory to an argument parser"""
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: %(default)s)")
+    parser.add_argument("--vms", type=int, default=1000, help="Number of VMs (default: %(default)s)")
+    parser.add_argument("--hosts", type=int, default=20, help="Number of hosts (default: %(default)s)")
+    parser.add_argument("--clusters", type=int, default=2, help="Number of clusters (default: %(default)s)")
+    parser.add_argument("--datacenters", type=int, default=1,
+                        help="Number of datacenters (default: %(default)s)")
+    parser.add_argument("--storage-domains", type=int, default=4,
+                        help="Number of storage domains (default: %(default)s)")
+    parser.add_argument("--snapshots", type=float, default=1.0,
+                        help="Mean number of snapshots per VM besides the active one (default: %(default)s)")
+    parser.add_argument("--vms-up", type=float, default=0.9,
+                        help="Fraction of running VMs (default: %(default)s)")
+    parser.add_argument("--history", type=int, default=40,
+                        help="Number of values of the usage history statistics (default: %(default)s)")
+
+def inventory_from_arguments(args):
+    """Return the inventory described by the options of add_arguments"""
+    return SyntheticInventory(
+        seed=args.seed,
+        vms=args.vms,
+        hosts=args.hosts,
+        clusters=args.clusters,
+        datacenters=args.datacenters,
+        storage_domains=args.storage_domains,
+        snapshots=args.snapshots,
+        vms_up=args.vms_up,
+        history=args.history,
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--out", type=Path, required=True,
+                        help="Directory the documents are written to, one file per endpoint")
+    args = parser.parse_args(argv)
+    
+    args.out.mkdir(parents=True, exist_ok=True)
+    for name, document in inventory_from_arguments(args).documents().items():
+        path = args.out / f"{name}.json"
+        path.write_text(json.dumps(document))
+        print(f"{path}: {path.stat().st_size} bytes", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Tests of the state the oVirt special agent keeps across runs, against the mock engine"""
+
+# License: GNU General Public License v2
+
+import io
+import json
+import re
+import threading
+
+import pytest
+
+from cmk_addons.plugins.ovirt.special_agents.agent_ovirt import collect_engine, parse_arguments
+from cmk_addons.plugins.ovirt.tools.mock_engine import PREFIX, MockEngine
+from cmk_addons.plugins.ovirt.tools.synthetic_inventory import SyntheticInventory
+
+VMS = 50
+
+@pytest.fixture
+def engine():
+    server = MockEngine(("127.0.0.1", 0), SyntheticInventory(vms=VMS, hosts=2, clusters=2))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _parse(text):
+    """Return the sections of agent output as (piggyback target, name, cached, data)"""
+    sections = []
+    target = header = None
+    for line in text.splitlines():
+        if match := re.fullmatch(r"<<<<(.*)>>>>", line):
+            target = match.group(1) or None
+        elif match := re.fullmatch(r"<<<([^:>]+)(.*)>>>", line):
+            header = match.group(1), "cached(" in match.group(2)
+        elif header is not None:
+            sections.append((target, *header, json.loads(line)))
+            header = None
+    return sections
+
+def run_agent(engine, cache_dir, *options):
+    """Run the agent once and return its sections"""
+    args = parse_arguments([
+        "--engine-url", f"http://127.0.0.1:{engine.server_port}{PREFIX}", "-s", "secret",
+        "--cache-dir", str(cache_dir), "--retries", "0", *options,
+    ])
+    output = collect_engine(args, args.engine_url, args.username, args.secret)
+    stream = io.StringIO()
+    output.write(stream)
+    return _parse(stream.getvalue())
+
+def _targets(sections, name, cached=None):
+    return {target for target, section, is_cached, _ in sections
+            if section == name and (cached is None or is_cached == cached)}
+
+def _section(sections, name):
+    return next((data for _, section, _, data in sections if section == name), None)
+
+def _vm_names(inventory, cluster=None):
+    return {f"vm{index:05d}" for index in range(inventory.vms)
+            if cluster is None or inventory.vm_cluster(index) == cluster}
+
+def test_failed_page_without_stale_data(engine, tmp_path):
+    engine.fail = ("page%202",)
+    sections = run_agent(engine, tmp_path, "--page-size", "20", "--max-stale", "0")
+    assert len(_targets(sections, "ovirt_vmstats")) == 20
+    assert _section(sections, "ovirt_snapshots_engine") is None
+    assert _section(sections, "ovirt_agent_status")["failed"] == ["vms"]
+    
+    # The incomplete snapshots were not cached
+    engine.fail = ()
+    sections = run_agent(engine, tmp_path, "--page-size", "20", "--max-stale", "0")
+    assert len(_section(sections, "ovirt_snapshots_engine")) == VMS
+    assert _targets(sections, "ovirt_snapshots") == _vm_names(engine.inventory)
+
+def test_failed_page_with_stale_data(engine, tmp_path):
+    run_agent(engine, tmp_path, "--page-size", "20")
+    engine.fail = ("page%202",)
+    sections = run_agent(engine, tmp_path, "--page-size", "20")
+    assert len(_targets(sections, "ovirt_vmstats", cached=False)) == 20
+    assert len(_targets(sections, "ovirt_vmstats", cached=True)) == VMS - 20
+    status = _section(sections, "ovirt_agent_status")
+    assert status["failed"] == []
+    assert list(status["stale"]) == ["vms"]
+
+def test_failed_cluster_keeps_other_clusters(engine, tmp_path):
+    engine.fail = ("cluster%3Dcluster01",)
+    sections = run_agent(engine, tmp_path, "--partition-by-cluster", "--max-stale", "0")
+    assert _targets(sections, "ovirt_vmstats") == _vm_names(engine.inventory, cluster=0)
+    assert _section(sections, "ovirt_agent_status")["failed"] == ["vms"]
+
+def test_failed_cluster_with_stale_data(engine, tmp_path):
+    run_agent(engine, tmp_path, "--partition-by-cluster")
+    engine.fail = ("cluster%3Dcluster01",)
+    sections = run_agent(engine, tmp_path, "--partition-by-cluster")
+    assert _targets(sections, "ovirt_vmstats", cached=False) == _vm_names(engine.inventory, cluster=0)
+    assert _targets(sections, "ovirt_vmstats", cached=True) == _vm_names(engine.inventory, cluster=1)
+
+def test_breaker_counts_runs(engine, tmp_path):
+    # The other endpoints succeed in the same runs
+    engine.fail = ("/api/vms",)
+    for failures in (1, 2):
+        breaker = _section(run_agent(engine, tmp_path, "--breaker-threshold", "3"), "ovirt_agent_status")["breaker"]
+        assert (breaker["failures"], breaker["state"]) == (failures, "closed")
+    
+    engine.fail = ()
+    breaker = _section(run_agent(engine, tmp_path, "--breaker-threshold", "3"), "ovirt_agent_status")["breaker"]
+    assert (breaker["failures"], breaker["state"]) == (0, "closed")
+
+def test_breaker_opens(engine, tmp_path):
+    engine.fail = ("/api/vms",)
+    for _ in range(2):
+        run_agent(engine, tmp_path, "--breaker-threshold", "2")
+    engine.stats(reset=True)
+    breaker = _section(run_agent(engine, tmp_path, "--breaker-threshold", "2"), "ovirt_agent_status")["breaker"]
+    assert (breaker["failures"], breaker["state"]) == (2, "open")
+    assert engine.stats()["total"] == 0
+
+def test_snapshots_refetched_after_event(engine, tmp_path):
+    # Determines the event position, then stores the snapshots of all VMs
+    for _ in range(2):
+        run_agent(engine, tmp_path, "--events")
+    engine.stats(reset=True)
+    run_agent(engine, tmp_path, "--events")
+    assert engine.stats()["endpoints"]["vms"] == 1
+    
+    engine.add_event(68, vm=3)
+    engine.stats(reset=True)
+    sections = run_agent(engine, tmp_path, "--events")
+    # The VMs and the snapshots of the VM named in the event
+    assert engine.stats()["endpoints"]["vms"] == 2
+    assert _targets(sections, "ovirt_snapshots") == _vm_names(engine.inventory)
+    assert _section(sections, "ovirt_agent_status")["events"]["invalidated"] == []
+
+@pytest.mark.parametrize("options", [(), ("--events",)])
+def test_cache_per_vm_search(engine, tmp_path, options):
+    for cluster in (0, 1):
+        for _ in range(2):
+            sections = run_agent(engine, tmp_path, "--vm-search", f"cluster=cluster{cluster:02d}", *options)
+        vm_names = _vm_names(engine.inventory, cluster)
+        assert _targets(sections, "ovirt_vmstats") == vm_names
+        assert _targets(sections, "ovirt_snapshots") == vm_names
+        assert {vm["name"] for vm in _section(sections, "ovirt_snapshots_engine")} == vm_names
+    
+    # The snapshots of the first search are still stored
+    engine.stats(reset=True)
+    run_agent(engine, tmp_path, "--vm-search", "cluster=cluster00", *options)
+    assert engine.stats()["endpoints"]["vms"] == 1
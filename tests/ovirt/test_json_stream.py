@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Tests of the incremental JSON decoding of the oVirt special agent"""
+
+# License: GNU General Public License v2
+
+import json
+import random
+
+import pytest
+
+from cmk_addons.plugins.ovirt.special_agents.agent_ovirt import iter_json_array
+
+DOCUMENT = {
+    "count": 25506.902,
+    "exponent": -1.5e-7,
+    "flag": True,
+    "vm": [
+        {"id": "a", "name": "vmä", "statistics": {"statistic": [{"values": {"value": [{"datum": 25506.902}]}}]}},
+        {"id": "b", "memory": 8589934592, "nested": [[], {}, [1, 2.5, None, False]]},
+        {"id": "c", "description": 'escaped "quote" and , ] }'},
+    ],
+    "total": 3,
+}
+
+def _split(data, cuts):
+    """Split data at the given offsets"""
+    bounds = [0, *sorted(cuts), len(data)]
+    return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_chunk_splits(seed):
+    data = json.dumps(DOCUMENT).encode("utf-8")
+    rng = random.Random(seed)
+    cuts = rng.sample(range(1, len(data)), rng.randint(1, 40))
+    assert list(iter_json_array(_split(data, cuts), "vm")) == json.loads(data)["vm"]
+
+def test_every_single_split():
+    data = json.dumps({"before": 25506.902, "vm": [{"value": 1e10}, 7], "after": 12}).encode("utf-8")
+    for cut in range(1, len(data)):
+        assert list(iter_json_array(_split(data, [cut]), "vm")) == [{"value": 1e10}, 7]
+
+def test_number_split_after_fraction_point():
+    chunks = [b'{"size": 25506.', b'902, "vm": [{"id": "a"}]}']
+    assert list(iter_json_array(chunks, "vm")) == [{"id": "a"}]
+
+def test_empty_responses():
+    assert list(iter_json_array([b""], "vm")) == []
+    assert list(iter_json_array([b"{}"], "vm")) == []
+    assert list(iter_json_array([b'{"vm": []}'], "vm")) == []